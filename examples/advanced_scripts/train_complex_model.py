@@ -14,7 +14,7 @@
 
 from ast import Return
 from functools import partial
-from flax.core import unfreeze, freeze
+from flax.core import copy as frozen_copy
 from typing import Dict, Optional, Union
 from jax.random import split, PRNGKey
 from jax import numpy as jnp, value_and_grad
@@ -24,7 +24,7 @@ import numpy as np
 from optax import adam
 from tqdm import tqdm
 import os
-from orbax.checkpoint import PyTreeCheckpointer
+from orbax.checkpoint import AsyncCheckpointer, PyTreeCheckpointHandler
 import warnings
 
 from grad_dft import (
@@ -33,13 +33,15 @@ from grad_dft import (
     DispersionFunctional,
     NeuralFunctional,
     canonicalize_inputs,
+    residual_tower,
     dm21_coefficient_inputs,
     densities,
     dm21_combine_cinputs,
     dm21_combine_densities,
     dm21_hfgrads_cinputs,
     dm21_hfgrads_densities,
-    loader
+    loader,
+    pad_molecule_batch,
 )
 
 from torch.utils.tensorboard import SummaryWriter
@@ -47,7 +49,6 @@ import jax
 
 from jax.config import config
 config.update("jax_enable_x64", True)
-config.update('jax_debug_nans', True)
 warnings.warn("This script takes a long time to run.")
 
 # In this example we explain how to replicate the experiments that train
@@ -74,30 +75,25 @@ out_features = 20  # 2 for each spin x 2 for exchange/correlation x 4 for MGGA +
 sigmoid_scale_factor = 2.0
 activation = gelu
 loadcheckpoint = False
+# The hidden layers run in bfloat16, while the parameters, optimizer state, heads and the
+# integration of the energy stay in full precision. Set to jnp.float64 to disable.
+compute_dtype = jnp.bfloat16
 
 
 def nn_coefficients(instance, rhoinputs, *_, **__):
     x = canonicalize_inputs(rhoinputs)  # Making sure dimensions are correct
 
     # Initial layer: log -> dense -> tanh
-    x = jnp.log(jnp.abs(x) + squash_offset)  # squash_offset = 1e-4
+    x = jnp.log(jnp.maximum(jnp.abs(x), squash_offset))  # squash_offset = 1e-4
     instance.sow("intermediates", "log", x)
-    x = instance.dense(features=layer_widths[0])(x)  # features = 256
+    x = instance.dense(features=layer_widths[0], dtype=compute_dtype)(x)  # features = 512
     instance.sow("intermediates", "initial_dense", x)
     x = jnp.tanh(x)
     instance.sow("intermediates", "tanh", x)
 
-    # 6 Residual blocks with 256-features dense layer and layer norm
-    for features, i in zip(layer_widths, range(len(layer_widths))):  # layer_widths = [256]*6
-        res = x
-        x = instance.dense(features=features)(x)
-        instance.sow("intermediates", "residual_dense_" + str(i), x)
-        x = x + res  # nn.Dense + Residual connection
-        instance.sow("intermediates", "residual_residual_" + str(i), x)
-        x = instance.layer_norm()(x)  # + res # nn.LayerNorm
-        instance.sow("intermediates", "residual_layernorm_" + str(i), x)
-        x = activation(x)  # activation = jax.nn.gelu
-        instance.sow("intermediates", "residual_elu_" + str(i), x)
+    # 10 Residual blocks with 512-features dense layer and layer norm
+    x = residual_tower(instance, x, len(layer_widths))
+    instance.sow("intermediates", "residual_tower", x)
 
     return instance.head(x, out_features, sigmoid_scale_factor)
 
@@ -106,52 +102,18 @@ def nn_dispersion(instance: nn.Module, x, *_, **__):
     Rab = x[:, 0]  # The distance
     n0 = x[:, 1:]  #
 
-    ####### First we model RAB0 ########
-
-    # Implement a neural network that takes x as input
-    x = instance.dense(features=nlc_layer_widths[0])(n0)  # features = 256
+    # A single residual trunk is shared by the Rab0 and Cab heads
+    x = instance.dense(features=nlc_layer_widths[0], dtype=compute_dtype)(n0)  # features = 128
     instance.sow("intermediates", "initial_dense", x)
     x = jnp.tanh(x)
     instance.sow("intermediates", "tanh", x)
 
-    # 6 Residual blocks with 256-features dense layer and layer norm
-    for features, i in zip(
-        nlc_layer_widths, range(len(nlc_layer_widths))
-    ):  # layer_widths = [256]*6
-        res = x
-        x = instance.dense(features=features)(x)
-        instance.sow("intermediates", "residual_dense_" + str(i), x)
-        x = x + res  # nn.Dense + Residual connection
-        instance.sow("intermediates", "residual_residual_" + str(i), x)
-        x = instance.layer_norm()(x)  # + res # nn.LayerNorm
-        instance.sow("intermediates", "residual_layernorm_" + str(i), x)
-        x = activation(x)  # activation = jax.nn.gelu
-        instance.sow("intermediates", "residual_elu_" + str(i), x)
+    # 5 Residual blocks with 128-features dense layer and layer norm
+    x = residual_tower(instance, x, len(nlc_layer_widths))
+    instance.sow("intermediates", "residual_tower", x)
 
+    # Each call to the head creates its own dense layer, so both heads have separate parameters
     Rab0 = instance.head(x, 1, sigmoid_scale_factor)
-
-    ####### Then we model CAB ########
-
-    # Implement a neural network that takes x as input
-    x = instance.dense(features=nlc_layer_widths[0])(n0)  # features = 256
-    instance.sow("intermediates", "initial_dense", x)
-    x = jnp.tanh(x)
-    instance.sow("intermediates", "tanh", x)
-
-    # 6 Residual blocks with 256-features dense layer and layer norm
-    for features, i in zip(
-        nlc_layer_widths, range(len(nlc_layer_widths))
-    ):  # layer_widths = [256]*6
-        res = x
-        x = instance.dense(features=features)(x)
-        instance.sow("intermediates", "residual_dense_" + str(i), x)
-        x = x + res  # nn.Dense + Residual connection
-        instance.sow("intermediates", "residual_residual_" + str(i), x)
-        x = instance.layer_norm()(x)  # + res # nn.LayerNorm
-        instance.sow("intermediates", "residual_layernorm_" + str(i), x)
-        x = activation(x)  # activation = jax.nn.gelu
-        instance.sow("intermediates", "residual_elu_" + str(i), x)
-
     Cab = instance.head(x, 1, sigmoid_scale_factor)
 
     return Cab / (1 + jnp.exp(-(Rab / Rab0 - 1)))
@@ -177,9 +139,10 @@ functional = NeuralFunctional(
         self, params, molecule, nograd_cinputs, grad_cinputs, densities, omegas
     ),
     combine_inputs=dm21_combine_cinputs,
+    activation=activation,
 )
 
-DispersionNN = DispersionFunctional(dispersion=nn_dispersion)
+DispersionNN = DispersionFunctional(dispersion=nn_dispersion, activation=activation)
 
 ####### Initializing the functional and some parameters #######
 
@@ -193,9 +156,7 @@ params = functional.init(key, rhoinputs)
 dispersioninputs = jax.random.normal(key, shape=[2, 4])
 dparams = DispersionNN.init(key, dispersioninputs)
 
-params = unfreeze(params)
-params["dispersion"] = dparams["params"]
-params = freeze(params)
+params = frozen_copy(params, {"dispersion": dparams["params"]})
 
 loadcheckpoint = False
 checkpoint_step = 0
@@ -207,9 +168,12 @@ tx = adam(learning_rate=lr, b1=momentum)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 
-orbax_checkpointer = PyTreeCheckpointer()
+# Checkpoints are written to disk in the background, overlapping with the next epoch.
+orbax_checkpointer = AsyncCheckpointer(PyTreeCheckpointHandler())
 
-ckpt_dir = os.path.join(dirpath, "ckpts/", "checkpoint_" + str(checkpoint_step) + "/")
+# The checkpoints of every epoch are saved to, and loaded from, checkpoint_<step> folders here
+ckpts_dir = os.path.join(dirpath, "ckpts")
+ckpt_dir = os.path.join(ckpts_dir, "checkpoint_" + str(checkpoint_step))
 if loadcheckpoint:
     train_state = functional.load_checkpoint(
         tx=tx, ckpt_dir=ckpt_dir, step=checkpoint_step, orbax_checkpointer=orbax_checkpointer
@@ -225,6 +189,7 @@ if loadcheckpoint:
 compute_energy = energy_predictor(functional, nlc_functional=DispersionNN)
 
 
+@jax.jit
 @partial(value_and_grad, has_aux=True)
 def loss(params, molecule, true_energy):
     # In general the loss function should be able to accept [params, system (eg, molecule or reaction), true_energy]
@@ -248,7 +213,77 @@ def loss(params, molecule, true_energy):
     return cost_value, metrics
 
 
-kernel = jax.jit(train_kernel(tx, loss))
+def batched_loss(params, systems, targets):
+    # The systems are stacked along a leading axis and the gradients averaged over it.
+    # The padding systems that fill the last batches of a bucket have zero weight.
+    true_energies, weights = targets
+    (cost_values, metrics), grads = jax.vmap(loss, in_axes=(None, 0, 0))(
+        params, systems, true_energies
+    )
+    mean = lambda x: jnp.tensordot(weights, x, axes=1) / jnp.sum(weights)
+    return (mean(cost_values), jax.tree_util.tree_map(mean, metrics)), jax.tree_util.tree_map(
+        mean, grads
+    )
+
+
+# train_kernel compiles the whole forward, backward and optimizer update into a single XLA
+# program, and donates the buffers of params and opt_state so that they are updated in place.
+kernel = train_kernel(tx, batched_loss)
+
+# Number of systems processed together in a training step.
+batch_size = 4
+# Molecules are padded to a multiple of this number of grid points, so that molecules
+# with similar grids fall in the same bucket.
+grid_bucket_size = 2048
+# Number of training steps between host synchronizations for logging.
+log_every = 10
+
+
+def pad_grid(molecule, grid_size):
+    r"""Zero-pad the arrays of a molecule along the grid axis, the first one, to grid_size points.
+    The padded points have zero weight and zero orbitals, so they do not contribute."""
+
+    n = molecule.grid_size
+
+    def pad(leaf):
+        if jnp.ndim(leaf) == 0 or jnp.shape(leaf)[0] != n:
+            return leaf
+        return jnp.pad(leaf, [(0, grid_size - n)] + [(0, 0)] * (jnp.ndim(leaf) - 1))
+
+    return jax.tree_util.tree_map(pad, molecule)
+
+
+def make_batches(load, batch_size):
+    r"""Group the molecules yielded by the loader into batches of batch_size molecules,
+    stacked with `pad_molecule_batch` so that they can be processed with `jax.vmap`.
+
+    Molecules are bucketed by their grid size, rounded up to a multiple of grid_bucket_size,
+    and by their number of orbitals and atoms. Every batch of a bucket has the same shapes,
+    so the training kernel is compiled once per bucket. The partial batches at the end are
+    filled with copies of their first molecule, with zero weight.
+    Yields the batched molecules and the weights of each of them."""
+
+    def stack(molecules):
+        weights = jnp.zeros(batch_size).at[: len(molecules)].set(1.0)
+        molecules = molecules + molecules[:1] * (batch_size - len(molecules))
+        return pad_molecule_batch(molecules), weights
+
+    buckets = {}
+    for _, molecule in load:
+        # The name and basis are variable-length integer codes, not needed for training
+        molecule = molecule.replace(name=None, basis=None)
+        grid_size = -(-molecule.grid_size // grid_bucket_size) * grid_bucket_size
+        key = (grid_size, molecule.mo_coeff.shape[-1], len(molecule.atom_index), molecule.is_restricted)
+        bucket = buckets.setdefault(key, [])
+        bucket.append(pad_grid(molecule, grid_size))
+        if len(bucket) == batch_size:
+            yield stack(bucket)
+            bucket.clear()
+
+    for bucket in buckets.values():
+        if bucket:
+            yield stack(bucket)
+
 
 ######## Training epoch ########
 
@@ -262,20 +297,28 @@ def train_epoch(state, training_files, training_data_dirpath):
         fpath = os.path.join(training_data_dirpath, file)
         print("Training on file: ", fpath, "\n")
 
-        load = loader(fname=fpath, randomize=True, training=True, config_omegas=omegas)
-        for _, system in tqdm(load, "Molecules/reactions per file"):
-            params, opt_state, cost_val, metrics = kernel(params, opt_state, system, system.energy)
-            del system
-
-            # Logging the resulting metrics
-            for k in metrics.keys():
-                print(k, metrics[k])
+        # The loader reads the next batch of systems in a background thread while training
+        load = loader(
+            fname=fpath, randomize=True, training=True, config_omegas=omegas, prefetch=batch_size
+        )
+        progress = tqdm(make_batches(load, batch_size), "Batches of molecules/reactions per file")
+        for step, (systems, weights) in enumerate(progress):
+            params, opt_state, cost_val, metrics = kernel(
+                params, opt_state, systems, (systems.energy, weights)
+            )
+            del systems
             batch_metrics.append(metrics)
 
-    epoch_metrics = {
-        k: np.mean([jax.device_get(metrics[k]) for metrics in batch_metrics])
-        for k in batch_metrics[0]
-    }
+            # Only block on the device at logging points, so that dispatch of the
+            # next step overlaps with the host side work.
+            if step % log_every == 0:
+                jax.block_until_ready(params)
+                progress.set_postfix({k: float(v) for k, v in metrics.items()})
+
+    # The metrics stay on the device during the epoch, are averaged there, and only
+    # one scalar per metric is transferred to the host
+    batch_metrics = jax.tree_util.tree_map(lambda *xs: jnp.stack(xs), *batch_metrics)
+    epoch_metrics = jax.device_get(jax.tree_util.tree_map(jnp.mean, batch_metrics))
     state = (params, opt_state, cost_val)
     return state, metrics, epoch_metrics
 
@@ -299,6 +342,15 @@ for epoch in range(initepoch, num_epochs + initepoch):
     for metric in epoch_metrics.keys():
         writer.add_scalar(f"/{metric}/train", epoch_metrics[metric], epoch)
     writer.flush()
-    functional.save_checkpoints(params, tx, step=epoch, orbax_checkpointer=orbax_checkpointer)
+    # A host copy is saved, as the device buffers of params are donated to the next step.
+    functional.save_checkpoints(
+        jax.device_get(params),
+        tx,
+        step=epoch,
+        orbax_checkpointer=orbax_checkpointer,
+        ckpt_dir=ckpts_dir,
+    )
     print(f"-------------\n")
     print(f"\n")
+
+orbax_checkpointer.wait_until_finished()
@@ -24,8 +24,9 @@ import warnings
 
 from grad_dft.interface.pyscf import molecule_from_pyscf
 from grad_dft.interface.pyscf import loader
-from grad_dft.functional import NeuralFunctional, canonicalize_inputs, dm21_coefficient_inputs, densities
+from grad_dft.functional import NeuralFunctional, canonicalize_inputs, residual_tower, dm21_coefficient_inputs, densities
 from jax.nn import gelu
+from flax import linen as nn
 from orbax.checkpoint import PyTreeCheckpointer
 from torch.utils.tensorboard import SummaryWriter
 
@@ -77,22 +78,14 @@ def coefficients(instance, rhoinputs, *_, **__):
     # Initial layer: log -> dense -> tanh
     x = jnp.log(jnp.abs(x) + squash_offset)  # squash_offset = 1e-4
     instance.sow("intermediates", "log", x)
-    x = instance.dense(features=layer_widths[0])(x)  # features = 256
+    x = instance.dense(features=layer_widths[0])(x)  # features = 128
     instance.sow("intermediates", "initial_dense", x)
     x = jnp.tanh(x)
     instance.sow("intermediates", "tanh", x)
 
-    # 6 Residual blocks with 256-features dense layer and layer norm
-    for features, i in zip(layer_widths, range(len(layer_widths))):  # layer_widths = [256]*6
-        res = x
-        x = instance.dense(features=features)(x)
-        instance.sow("intermediates", "residual_dense_" + str(i), x)
-        x = x + res  # nn.Dense + Residual connection
-        instance.sow("intermediates", "residual_residual_" + str(i), x)
-        x = instance.layer_norm()(x)  # + res # nn.LayerNorm
-        instance.sow("intermediates", "residual_layernorm_" + str(i), x)
-        x = activation(x)  # activation = jax.nn.gelu
-        instance.sow("intermediates", "residual_elu_" + str(i), x)
+    # 5 Residual blocks with 128-features dense layer and layer norm
+    x = residual_tower(instance, x, len(layer_widths))
+    instance.sow("intermediates", "residual_tower", x)
 
     return instance.head(x, out_features, sigmoid_scale_factor)
 
@@ -101,6 +94,7 @@ functional = NeuralFunctional(
     coefficients=coefficients,
     energy_densities=partial(densities, functional_type="MGGA"),
     coefficient_inputs=dm21_coefficient_inputs,
+    activation=activation,
 )
 
 ####### Initializing the functional and some parameters #######
@@ -154,7 +148,7 @@ def loss(params, molecule, ground_truth_energy):
     return cost_value, metrics
 
 
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 
 ######## Training epoch ########
 
@@ -139,7 +139,7 @@ if loadcheckpoint:
 ########### Definition of the molecule energy prediction function #####################
 
 # Here we use one of the following. We will use the second here.
-compute_energy = jax.jit(energy_predictor(functional))
+compute_energy = energy_predictor(functional)
 
 
 ######## Predict function ########
@@ -120,7 +120,7 @@ def average_error(prediction_dict, noisy_target_dict, clean_target_dict):
 ########### Definition of the molecule energy prediction function #####################
 
 # Here we use one of the following. We will use the second here.
-compute_energy = jax.jit(energy_predictor(functional))
+compute_energy = energy_predictor(functional)
 
 ######## Predict function ########
 
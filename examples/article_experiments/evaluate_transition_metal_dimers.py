@@ -138,7 +138,7 @@ if loadcheckpoint:
 
 molecules = []
 
-compute_energy = jax.jit(energy_predictor(functional))
+compute_energy = energy_predictor(functional)
 
 def predict(state, test_files, data_dirpath):
     """Predict molecules in file."""
@@ -151,7 +151,7 @@ def loss(params, molecule, true_energy):
     return cost_value, metrics
 
 
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 
 ######## Training epoch ########
 
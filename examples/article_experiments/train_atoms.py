@@ -186,7 +186,7 @@ epoch_results = {}
 num_epochs = 101
 lr = 1e-4
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 # save epoch results to json
@@ -219,7 +219,7 @@ initepoch = 101
 num_epochs = 100
 lr = 1e-5
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 # save epoch results to json
@@ -255,7 +255,7 @@ initepoch = 201
 num_epochs = 100
 lr = 1e-6
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 # save epoch results to json
@@ -289,7 +289,7 @@ initepoch = 301
 num_epochs = 90
 lr = 1e-7
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 # save epoch results to json
@@ -323,7 +323,7 @@ initepoch = 391
 num_epochs = 50
 lr = 1e-8
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 # save epoch results to json
@@ -191,7 +191,7 @@ initepoch = checkpoint_step
 num_epochs = 101-initepoch
 lr = 3e-6
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 # save epoch results to json
@@ -228,7 +228,7 @@ initepoch = 101
 num_epochs = 201-initepoch
 lr = 1e-6
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 for epoch in range(initepoch + 1, num_epochs + initepoch + 1):
     # Use a separate PRNG key to permute input data during shuffling
@@ -261,7 +261,7 @@ initepoch = 201
 num_epochs = 301-initepoch
 lr = 1e-7
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 
@@ -296,7 +296,7 @@ initepoch = 301
 num_epochs = 351-initepoch
 lr = 1e-8
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 
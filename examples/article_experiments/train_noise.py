@@ -198,7 +198,7 @@ initepoch = 0
 num_epochs = 101
 lr = 1e-4
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 # save epoch results to json
@@ -231,7 +231,7 @@ initepoch = 101
 num_epochs = 100
 lr = 1e-5
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 for epoch in range(initepoch + 1, num_epochs + initepoch + 1):
@@ -265,7 +265,7 @@ initepoch = 201
 num_epochs = 100
 lr = 1e-6
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 for epoch in range(initepoch + 1, num_epochs + initepoch + 1):
@@ -297,7 +297,7 @@ initepoch = 301
 num_epochs = 90
 lr = 1e-7
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 for epoch in range(initepoch + 1, num_epochs + initepoch + 1):
@@ -329,7 +329,7 @@ initepoch = 391
 num_epochs = 50
 lr = 1e-8
 tx = adam(learning_rate=lr, b1=momentum)
-kernel = jax.jit(train_kernel(tx, loss))
+kernel = train_kernel(tx, loss)
 opt_state = tx.init(params)
 cost_val = jnp.inf
 for epoch in range(initepoch + 1, num_epochs + initepoch + 1):
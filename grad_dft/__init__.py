@@ -22,7 +22,8 @@ from .molecule import (
     orbital_grad,
     density,
     grad_density,
-    coulomb_energy
+    coulomb_energy,
+    pad_molecule_batch
 )
 from .solid import (
     Solid
@@ -35,6 +36,7 @@ from .functional import (
     correlation_polarization_correction, 
     exchange_polarization_correction,
     canonicalize_inputs,
+    residual_tower,
     dm21_coefficient_inputs,
     dm21_densities,
     densities,
@@ -45,7 +47,10 @@ from .functional import (
 )
 from .train import (
     train_kernel,
+    train_scan,
+    parallel_train_kernel,
     energy_predictor,
+    batched_energy_predictor,
     Harris_energy_predictor,
     simple_energy_loss,
     mse_energy_loss, 
@@ -411,6 +411,8 @@ def scf_loop(
         norm_gorb = jnp.inf
         cycle = 0
         nelectron = molecule.atom_index.sum() - molecule.charge
+        # The atomic orbital overlap on the grid does not change between cycles
+        grid_overlap = jnp.einsum("r,ra,rb->ab", molecule.grid.weights, molecule.ao, molecule.ao)
 
         predicted_e, fock = compute_energy(params, molecule, *args)
 
@@ -500,15 +502,13 @@ def scf_loop(
             rdm1 = molecule.make_rdm1()
             molecule = molecule.replace(rdm1=rdm1)
 
-            computed_charge = jnp.einsum(
-                "r,ra,rb,sab->", molecule.grid.weights, molecule.ao, molecule.ao, molecule.rdm1
-            )
+            computed_charge = jnp.einsum("ab,sab->", grid_overlap, molecule.rdm1)
             assert jnp.isclose(
                 nelectron, computed_charge, atol=1e-3
             ), "Total charge is not conserved"
 
             # Update the chi matrix
-            if molecule.omegas:
+            if molecule.omegas is not None and len(molecule.omegas) > 0:
                 chi_start_time = time.time()
                 chi = generate_chi_tensor(
                     molecule.rdm1,
@@ -563,7 +563,7 @@ def scf_loop(
             molecule = molecule.replace(rdm1=rdm1)
 
             # Update the chi matrix
-            if molecule.omegas:
+            if molecule.omegas is not None and len(molecule.omegas) > 0:
                 chi = generate_chi_tensor(
                     molecule.rdm1,
                     molecule.ao,
@@ -15,10 +15,11 @@
 from dataclasses import dataclass
 import itertools
 import os
-from typing import Callable, Optional, List, Dict, Union
+from typing import Any, Callable, Optional, List, Dict, Union
 from functools import partial
 import math
 
+import jax
 from jax import grad
 from jax import numpy as jnp
 from jax.lax import Precision, stop_gradient
@@ -248,7 +249,8 @@ class Functional(nn.Module):
         """
 
         coefficients = self.apply(params, coefficient_inputs, **kwargs)
-        xc_energy_density = jnp.einsum("rf,rf->r", coefficients, densities)
+        # An elementwise product and reduction fuses with the coefficients, unlike the einsum
+        xc_energy_density = jnp.sum(coefficients * densities, axis=1)
         xc_energy_density = abs_clip(xc_energy_density, clip_cte)
         return self._integrate(xc_energy_density, grid.weights)
 
@@ -358,6 +360,9 @@ class NeuralFunctional(Functional):
     activation: Callable, optional
         activation function for the neural network, by default gelu
     param_dtype: DType, optional
+    collect_intermediates: bool, optional
+        whether calls to `sow` store intermediate activations, by default False.
+        When False, `sow` is a no-op and the intermediates are not kept alive.
 
     Notes
     ----------
@@ -392,6 +397,7 @@ class NeuralFunctional(Functional):
     bias_init: Callable = zeros
     activation: Callable = gelu
     param_dtype: DType = default_dtype()
+    collect_intermediates: bool = False
 
     def setup(self):
         r"""Sets up the neural network layers. """
@@ -404,6 +410,12 @@ class NeuralFunctional(Functional):
 
         self.layer_norm = partial(nn.LayerNorm, param_dtype=self.param_dtype)
 
+    def sow(self, col: str, name: str, value: Any, *args, **kwargs) -> bool:
+        r"""Stores an intermediate value only if `collect_intermediates` is set."""
+        if not self.collect_intermediates:
+            return False
+        return super().sow(col, name, value, *args, **kwargs)
+
     def head(self, x: Array, local_features, sigmoid_scale_factor):
         r"""
         Final layer of the neural network.
@@ -646,7 +658,9 @@ def dm21_combine_cinputs(
     """
 
     # Remember that DM concatenates the hf density in the x features by spin...
-    return jnp.concatenate([cinputs, ehf[:, 0].T, ehf[:, 1].T], axis=1)
+    # (omega, spin, grid) -> (grid, spin * omega), so that a single copy is made
+    ehf = jnp.transpose(ehf, (2, 1, 0)).reshape(ehf.shape[-1], -1)
+    return jnp.concatenate([cinputs, ehf], axis=1)
 
 
 def dm21_combine_densities(
@@ -670,9 +684,7 @@ def dm21_combine_densities(
     """
 
     # ... and in the y features by omega.
-    return jnp.concatenate(
-        [densities] + [ehf[i].sum(axis=0, keepdims=True).T for i in range(len(ehf))], axis=1
-    )
+    return jnp.concatenate([densities, ehf.sum(axis=1).T], axis=1)
 
 @jaxtyped
 @typechecked
@@ -944,6 +956,67 @@ def canonicalize_inputs(x):
     else:
         return x
 
+
+def residual_tower(instance: nn.Module, x: Array, n_blocks: int, name: str = "residual") -> Array:
+    r"""
+    A stack of `n_blocks` residual blocks dense -> residual -> layer norm -> activation,
+    to be called from the `coefficients` or `dispersion` function of a neural functional.
+
+    The parameters of all the blocks are stored stacked along a leading axis, each block
+    initialized with the `kernel_init` and `bias_init` of `instance`, and the tower is driven
+    by `jax.lax.scan`, so it is traced and compiled once instead of being unrolled `n_blocks`
+    times. The computation is carried out in the dtype of `x`.
+
+    Parameters
+    ----------
+    instance : nn.Module
+        The `NeuralFunctional` or `DispersionFunctional` holding the parameters.
+    x : Array
+        The input to the tower, whose last axis is kept as the number of features.
+    n_blocks : int
+        The number of residual blocks.
+    name : str, optional
+        The prefix of the parameter names, by default "residual".
+
+    Returns
+    -------
+    Array
+    """
+
+    def stacked(init):
+        def init_blocks(key, shape, dtype):
+            keys = jax.random.split(key, shape[0])
+            return jnp.stack([init(k, shape[1:], dtype) for k in keys])
+
+        return init_blocks
+
+    features = x.shape[-1]
+    kernels = instance.param(
+        name + "_kernels", stacked(instance.kernel_init), (n_blocks, features, features), instance.param_dtype
+    )
+    biases = instance.param(
+        name + "_biases", stacked(instance.bias_init), (n_blocks, features), instance.param_dtype
+    )
+    scales = instance.param(name + "_scales", nn.initializers.ones, (n_blocks, features), instance.param_dtype)
+    offsets = instance.param(name + "_offsets", zeros, (n_blocks, features), instance.param_dtype)
+
+    def layer_norm(x, scale, offset, epsilon=1e-6):
+        # The statistics are computed in at least float32, as flax.linen.LayerNorm does
+        y = x.astype(jnp.promote_types(x.dtype, jnp.float32))
+        y = (y - jnp.mean(y, axis=-1, keepdims=True)) * jax.lax.rsqrt(
+            jnp.var(y, axis=-1, keepdims=True) + epsilon
+        )
+        return y.astype(x.dtype) * scale.astype(x.dtype) + offset.astype(x.dtype)
+
+    def block(x, block_params):
+        kernel, bias, scale, offset = block_params
+        x = x @ kernel.astype(x.dtype) + bias.astype(x.dtype) + x  # Dense + Residual connection
+        x = layer_norm(x, scale, offset)
+        return instance.activation(x), None
+
+    x, _ = jax.lax.scan(block, x, (kernels, biases, scales, offsets))
+    return x
+
 ################ Spin polarization correction functions ################
 
 
@@ -1097,11 +1170,37 @@ def densities(
             raise ValueError(
                 f"Functional type {functional_type} not recognized, must be one of LDA, GGA, MGGA."
             )
+    else:
+        u_range, w_range = functional_type["u_range"], functional_type["w_range"]
+
+    return _local_features(
+        atoms.density(),
+        atoms.grad_density(),
+        atoms.kinetic_density(),
+        u_range=tuple(u_range),
+        w_range=tuple(w_range),
+        clip_cte=clip_cte,
+    )
+
+
+@partial(jax.jit, static_argnames=["u_range", "w_range", "clip_cte"])
+def _local_features(
+    rho: Float[Array, "grid spin"],
+    grad_rho: Float[Array, "grid spin 3"],
+    tau: Float[Array, "grid spin"],
+    u_range: tuple,
+    w_range: tuple,
+    clip_cte: float = 1e-30,
+) -> Float[Array, "grid n_features"]:
+    r"""
+    Computes the features of `densities` for fixed exponent ranges.
+
+    The ranges are static arguments, so the loops over them unroll at compile time
+    and each functional type is traced once.
+    """
+
+    beta = 1 / 1024.0
 
-    # Atoms preprocessing data
-    rho = atoms.density()
-    grad_rho = atoms.grad_density()
-    tau = atoms.kinetic_density()
     grad_rho_norm_sq = jnp.sum(grad_rho**2, axis=-1)
 
     # LDA preprocessing data
@@ -1216,6 +1315,7 @@ class DispersionFunctional(nn.Module):
     bias_init: Callable = zeros
     activation: Callable = gelu
     param_dtype: DType = default_dtype()
+    collect_intermediates: bool = False
 
     def setup(self):
         self.dense = partial(
@@ -1227,6 +1327,12 @@ class DispersionFunctional(nn.Module):
 
         self.layer_norm = partial(nn.LayerNorm, param_dtype=self.param_dtype)
 
+    def sow(self, col: str, name: str, value: Any, *args, **kwargs) -> bool:
+        r"""Stores an intermediate value only if `collect_intermediates` is set."""
+        if not self.collect_intermediates:
+            return False
+        return super().sow(col, name, value, *args, **kwargs)
+
     @nn.compact
     def __call__(self, *inputs) -> Scalar:
         r"""Where the functional is called, mapping the density to the energy.
@@ -13,14 +13,19 @@
 # limitations under the License.
 
 from random import shuffle
-from typing import List, Optional, Tuple, Union, Sequence, Dict
+from typing import Iterator, List, Optional, Tuple, Union, Sequence, Dict
+from queue import Full, Queue
+from threading import Event, Thread
 from itertools import chain, combinations_with_replacement, product
+from functools import partial
 import os
+import weakref
 
 import numpy as np
 from jax import numpy as jnp
-from jax.lax import Precision
-from jax import vmap
+from jax.lax import Precision, dynamic_update_slice
+from jax import device_get, device_put, jit
+from jax.dlpack import from_dlpack
 
 from pyscf import scf  # type: ignore
 from pyscf.dft import Grids, numint  # type: ignore
@@ -42,14 +47,15 @@ from jax.tree_util import tree_map
 from grad_dft.external import NeuralNumInt
 from grad_dft.external import Functional as ExternalFunctional
 
-from pyscf.pbc import df
-
 import h5py
 from pyscf import cc, dft, scf
 
 from jaxtyping import Array, Scalar, Int, Bool
 from grad_dft.external import _nu_chunk
 
+# Atomic number of each element symbol
+_ELEMENT_IDX = {e: i for i, e in enumerate(elements.ELEMENTS)}
+
 
 def grid_from_pyscf(grids: Grids, dtype: Optional[DType] = None) -> Grid:
     if grids.coords is None:
@@ -137,7 +143,7 @@ def molecule_from_pyscf(
     ) = to_device_arrays(*_package_outputs(mf, mf.grids, scf_iteration, grad_order), dtype=dtype)
 
     atom_index, nuclear_pos = to_device_arrays(
-        [elements.ELEMENTS.index(e) for e in mf.mol.elements],
+        np.fromiter((_ELEMENT_IDX[e] for e in mf.mol.elements), dtype=np.int64, count=mf.mol.natm),
         mf.mol.atom_coords(unit="bohr"),
         dtype=dtype,
     )
@@ -198,6 +204,9 @@ def molecule_from_pyscf(
         grid_level,
         scf_iteration,
         fock,
+        jnp.linalg.norm(fock),
+        # ROHF/ROKS also have 1D occupations, but their spin channels differ for open shells
+        is_restricted=np.ndim(mf.mo_occ) == 1 and mf.mol.spin == 0,
     )
     
 def solid_from_pyscf(
@@ -237,7 +246,7 @@ def solid_from_pyscf(
     ) = to_device_arrays(*pyscf_dat[0:-1], dtype=dtype)
 
     atom_index, nuclear_pos = to_device_arrays(
-        [elements.ELEMENTS.index(e) for e in kmf.mol.elements],
+        np.fromiter((_ELEMENT_IDX[e] for e in kmf.mol.elements), dtype=np.int64, count=kmf.mol.natm),
         kmf.mol.atom_coords(unit="bohr"),
         dtype=dtype,
     )
@@ -310,14 +319,16 @@ def mol_from_Molecule(molecule: Molecule):
 
     mol = Mole()
 
-    charges = np.asarray(molecule.atom_index)
-    positions = np.asarray(molecule.nuclear_pos)
+    # Converted once to native Python ints and floats
+    charges = np.asarray(molecule.atom_index, dtype=np.int64).tolist()
+    positions = np.asarray(molecule.nuclear_pos, dtype=np.float64).tolist()
 
-    mol.atom = [[int(charge), pos] for charge, pos in zip(charges, positions)]
+    mol.atom = list(zip(charges, positions))
     mol.basis = "".join(
         chr(num) for num in molecule.basis
     )  # The basis will generally be encoded as a jax array of ints
-    mol.unit = "angstrom" if molecule.unit_Angstrom else "bohr"
+    # nuclear_pos is always stored in Bohr, see molecule_from_pyscf
+    mol.unit = "bohr"
 
     mol.spin = int(molecule.spin)
     mol.charge = int(molecule.charge)
@@ -332,6 +343,7 @@ def saver(
     fname: str,
     reactions: Optional[Union[Reaction, Sequence[Reaction]]] = (),
     molecules: Optional[Union[Molecule, Sequence[Molecule]]] = (),
+    single_precision_orbitals: bool = False,
 ):
     r"""
     Saves the molecule data to a file, and computes and saves the corresponding chi
@@ -350,6 +362,9 @@ def saver(
         Reaction object(s) to calculate the chi object for.
     molecules : Union[Molecule, Sequence[Molecule]]
         Molecule object(s) to calculate the chi object for.
+    single_precision_orbitals : bool, optional
+        Whether to store the atomic orbitals and their derivatives on the grid (ao, grad_ao
+        and grad_n_ao) in single precision, halving their size on disk. By default False.
 
     Notes
     -----
@@ -390,7 +405,7 @@ def saver(
     if isinstance(reactions, Reaction):
         reactions = (reactions,)
 
-    with h5py.File(f"{fname}.hdf5", "a") as file:
+    with h5py.File(f"{fname}.hdf5", "a", **_HDF5_CACHE) as file:
         # First we save the reactions
         for i, reaction in enumerate(reactions):
             if reaction.name:
@@ -406,7 +421,7 @@ def saver(
                     )
                 else:
                     mol_group = react.create_group(f"molecule_{j}")
-                save_molecule_data(mol_group, molecule)
+                save_molecule_data(mol_group, molecule, single_precision_orbitals)
                 if j < len(reaction.reactants):
                     mol_group.attrs["type"] = "reactant"
                     mol_group["reactant_numbers"] = reaction.reactant_numbers[j]
@@ -424,7 +439,7 @@ def saver(
                 )
             else:
                 mol_group = file.create_group(f"molecule_{j}")
-            save_molecule_data(mol_group, molecule)
+            save_molecule_data(mol_group, molecule, single_precision_orbitals)
 
 
 def loader(
@@ -432,6 +447,7 @@ def loader(
     randomize: Optional[bool] = True,
     training: Optional[bool] = True,
     config_omegas: Optional[Union[Scalar, Sequence[Scalar]]] = None,
+    prefetch: int = 2,
 ):
     r"""
     Reads the molecule, energy and precomputed chi matrix from a file.
@@ -448,6 +464,10 @@ def loader(
         Whether we are training or not, by default True
     omegas : Union[Scalar, Sequence[Scalar]], optional
         Range-separation parameter. Use to select the chi matrix to load, by default None
+    prefetch : int, optional
+        Number of molecules/reactions read ahead in a background thread, so that reading
+        the file and moving the data to the device overlap with the work done on the
+        yielded items, by default 2. If 0, items are read only when requested.
 
     Yields
     -------
@@ -458,10 +478,67 @@ def loader(
 
     todo: randomize input
     """
+    items = _load_items(fname, randomize, training, config_omegas)
+    if prefetch > 0:
+        items = _prefetch(items, prefetch)
+    yield from items
+
+
+def _prefetch(items: Iterator, size: int) -> Iterator:
+    r"""Iterates over `items`, which are produced up to `size` items ahead in a background thread.
+    Exceptions raised while producing the items are raised again in the consumer.
+    """
+    buffer = Queue(maxsize=size)
+    stop = Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as error:
+            put((done, error))
+        finally:
+            items.close()
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # Also reached when the consumer stops early, so the file gets closed
+        stop.set()
+        thread.join()
+
+
+def _load_items(
+    fname: str,
+    randomize: Optional[bool] = True,
+    training: Optional[bool] = True,
+    config_omegas: Optional[Union[Scalar, Sequence[Scalar]]] = None,
+):
+    r"""Reads the molecules and reactions of a file one at a time, see `loader`."""
 
     fname = fname.replace(".hdf5", "").replace(".h5", "")
 
-    with h5py.File(os.path.normpath(f"{fname}.hdf5"), "r") as file:
+    with h5py.File(os.path.normpath(f"{fname}.hdf5"), "r", **_HDF5_CACHE) as file:
         items = list(file.items())  # List of tuples
         if randomize and training:
             shuffle(items)
@@ -470,33 +547,8 @@ def loader(
             if "molecule" in grp_name:
                 args = {}
                 for key, value in group.items():
-                    if key in ["name", "basis"]:
-                        args[key] = jnp.array([ord(char) for char in str(value[()])], dtype=jnp.int64)
-                    elif key in ["energy"]:
-                        args[key] = jnp.float64(value)
-                    elif key in ["scf_iteration", "spin", "charge"]:
-                        args[key] = jnp.int64(value)
-                    elif key in ["grad_n_ao"]:
-                        args[key] = {int(k): jnp.asarray(v, dtype = jnp.float64) for k, v in value.items()}
-                    elif key == "chi":
-                        # select the indices from the omegas array and load the corresponding chi matrix
-                        if config_omegas is None:
-                            args[key] = jnp.asarray(value)
-                        elif list(config_omegas) == []:
-                            args[key] = None
-                        else:
-                            omegas = list(group["omegas"])
-                            if isinstance(omegas, (int, float)):
-                                omegas = (omegas,)
-                            assert all(
-                                [omega in omegas for omega in config_omegas]
-                            ), f"chi tensors for omega list {config_omegas} were not all precomputed in the molecule"
-                            indices = [omegas.index(omega) for omega in config_omegas]
-                            args[key] = jnp.stack(
-                                [jnp.asarray(value, dtype = jnp.float64)[:, i] for i in indices], axis=1
-                            )
-                    else:
-                        args[key] = jnp.asarray(value, dtype=jnp.float64)
+                    load = _MOLECULE_LOADERS.get(key, _load_float64)
+                    args[key] = load(value, group, config_omegas)
 
                 for key, value in group.attrs.items():
                     if not training:
@@ -530,33 +582,10 @@ def loader(
                     if not training:
                         args["name"] = molecule_name.split("_")[1]
                     for key, value in molecule.items():
-                        if key in ["reactant_numbers", "product_numbers"]:
+                        if key in _REACTION_SKIPPED_KEYS:
                             continue
-                        elif key in ["name", "basis"]:
-                            args[key] = jnp.array([ord(char) for char in str(value[()])])
-                        elif key in ["energy"]:
-                            args[key] = jnp.float64(value)
-                        elif key in ["grad_n_ao"]:
-                            args[key] = {int(k): jnp.asarray(v) for k, v in value.items()}
-                        elif key == "chi":
-                            # select the indices from the omegas array and load the corresponding chi matrix
-                            if config_omegas is None:
-                                args[key] = jnp.asarray(value)
-                            elif config_omegas == []:
-                                args[key] = None
-                            else:
-                                omegas = list(group["omegas"])
-                                if isinstance(omegas, (int, float)):
-                                    omegas = (omegas,)
-                                assert all(
-                                    [omega in omegas for omega in config_omegas]
-                                ), f"chi tensors for omega list {config_omegas} were not all precomputed in the molecule"
-                                indices = [omegas.index(omega) for omega in config_omegas]
-                                args[key] = jnp.stack(
-                                    [jnp.asarray(value)[:, i] for i in indices], axis=1
-                                )
-                        else:
-                            args[key] = jnp.asarray(value)
+                        load = _REACTION_MOLECULE_LOADERS.get(key, _load_array)
+                        args[key] = load(value, molecule, config_omegas)
 
                     for key, value in molecule.attrs.items():
                         if not training and key not in ["type"]:
@@ -581,25 +610,160 @@ def loader(
                 yield "reaction", reaction
 
 
-def save_molecule_data(mol_group: h5py.Group, molecule: Molecule):
-    r"""Auxiliary function to save all data except for chi"""
+def _load_array(value: h5py.Dataset, group: h5py.Group, config_omegas, dtype=None):
+    return jnp.asarray(value, dtype=dtype)
+
+
+_load_float64 = partial(_load_array, dtype=jnp.float64)
+
+
+def _load_string(value: h5py.Dataset, group: h5py.Group, config_omegas, dtype=None):
+    # jax doesn't support strings, so they are loaded as integers
+    string = value[()]
+    if isinstance(string, bytes):  # h5py returns variable length strings as bytes
+        string = string.decode()
+    return jnp.array([ord(char) for char in str(string)], dtype=dtype)
+
+
+def _load_rep_tensor(value: h5py.Dataset, group: h5py.Group, config_omegas, dtype=None):
+    if value.ndim == 1:
+        # Stored with its 8-fold symmetry by save_molecule_data
+        return jnp.asarray(restore(1, value[()], group["h1e"].shape[-1]), dtype=dtype)
+    return jnp.asarray(value, dtype=dtype)
+
+
+def _load_chi(value: h5py.Dataset, group: h5py.Group, config_omegas, dtype=None):
+    # select the indices from the omegas array and load the corresponding chi matrix
+    if config_omegas is None:
+        return jnp.asarray(value)
+    elif np.size(config_omegas) == 0:
+        return None
+    indices = select_omega_indices(group["omegas"][()], config_omegas)
+    return jnp.asarray(read_omega_slices(value, indices), dtype=dtype)
+
+
+# How each dataset of a molecule group is loaded in `loader`, by name.
+# Other datasets are loaded as arrays.
+_MOLECULE_LOADERS = {
+    "name": partial(_load_string, dtype=jnp.int64),
+    "basis": partial(_load_string, dtype=jnp.int64),
+    "energy": lambda value, *_: jnp.float64(value),
+    "scf_iteration": lambda value, *_: jnp.int64(value),
+    "spin": lambda value, *_: jnp.int64(value),
+    "charge": lambda value, *_: jnp.int64(value),
+    "is_restricted": lambda value, *_: bool(value[()]),
+    "rep_tensor": partial(_load_rep_tensor, dtype=jnp.float64),
+    "grad_n_ao": lambda value, *_: {int(k): jnp.asarray(v, dtype=jnp.float64) for k, v in value.items()},
+    "chi": partial(_load_chi, dtype=jnp.float64),
+}
+
+_REACTION_MOLECULE_LOADERS = {
+    "name": _load_string,
+    "basis": _load_string,
+    "energy": lambda value, *_: jnp.float64(value),
+    "is_restricted": lambda value, *_: bool(value[()]),
+    "rep_tensor": _load_rep_tensor,
+    # Possibly stored in single precision, see save_molecule_data
+    "ao": _load_float64,
+    "grad_ao": _load_float64,
+    "grad_n_ao": lambda value, *_: {int(k): jnp.asarray(v, dtype=jnp.float64) for k, v in value.items()},
+    "chi": _load_chi,
+}
+
+_REACTION_SKIPPED_KEYS = frozenset(["reactant_numbers", "product_numbers"])
+
+
+def read_omega_slices(chi: h5py.Dataset, indices: np.ndarray) -> np.ndarray:
+    r"""
+    Reads the chi tensor of the selected omegas from an HDF5 dataset. Only the requested
+    slices of the omega axis are read from disk, instead of the whole tensor.
+
+    Parameters
+    ----------
+    chi : h5py.Dataset
+        The chi dataset, with shape (n_grid_points, n_omegas, n_spin, n_orbitals).
+    indices : np.ndarray
+        The indices along the omega axis to read, e.g. from `select_omega_indices`.
+
+    Returns
+    -------
+    np.ndarray
+        The chi tensor with shape (n_grid_points, len(indices), n_spin, n_orbitals).
+    """
+    # h5py only accepts increasing, unique indices; the requested order is restored in memory
+    unique, inverse = np.unique(np.asarray(indices), return_inverse=True)
+    return chi[:, unique][:, inverse]
+
+
+def select_omega_indices(
+    omegas: Union[Scalar, Sequence[Scalar]], config_omegas: Union[Scalar, Sequence[Scalar]]
+) -> np.ndarray:
+    r"""
+    Finds the position of each of the requested omegas among those the chi tensor
+    was precomputed for. The comparison is vectorized and done on the host, with a
+    floating point tolerance.
+
+    Parameters
+    ----------
+    omegas : Union[Scalar, Sequence[Scalar]]
+        The omegas the chi tensor was precomputed for.
+    config_omegas : Union[Scalar, Sequence[Scalar]]
+        The omegas to select.
+
+    Returns
+    -------
+    np.ndarray
+        The index along the omega axis of the chi tensor of each of `config_omegas`.
+    """
+    omegas = np.atleast_1d(np.asarray(omegas))
+    config_omegas = np.atleast_1d(np.asarray(config_omegas))
+    matches = np.isclose(config_omegas[:, None], omegas[None, :])
+    if not matches.any(axis=1).all():
+        raise ValueError(
+            f"chi tensors for omega list {config_omegas} were not all precomputed in the molecule"
+        )
+    return matches.argmax(axis=1)
+
+
+# The orbitals on the grid, usually the largest arrays of a molecule
+_SINGLE_PRECISION_FIELDS = frozenset(["ao", "grad_ao", "grad_n_ao"])
 
-    to_numpy = (
-        lambda arr: arr if (isinstance(arr, str) or isinstance(arr, float)) else np.asarray(arr)
-    )
-    d = tree_map(to_numpy, molecule.to_dict())
 
-    for name, data in d.items():
+def save_molecule_data(
+    mol_group: h5py.Group, molecule: Molecule, single_precision_orbitals: bool = False
+):
+    r"""Auxiliary function to save all data except for chi.
+
+    If `single_precision_orbitals`, the orbitals and their derivatives on the grid are stored
+    in single precision, which halves their size on disk. They are loaded back in double precision.
+    """
+
+    # All the arrays are fetched from the device in a single call, so the transfers overlap
+    for name, data in device_get(molecule.to_dict()).items():
         if data is None:
-            data = jnp.empty([1])
+            continue
         elif name in ["name", "basis"]:
             mol_group.create_dataset(name, data="".join(chr(num) for num in data))
-        elif name == "grad_n_ao":
-            d = mol_group.create_group(name)
+            continue
+        if single_precision_orbitals and name in _SINGLE_PRECISION_FIELDS:
+            data = tree_map(_to_single_precision, data)
+
+        if name == "grad_n_ao":
+            group = mol_group.create_group(name)
             for k, v in data.items():
-                d.create_dataset(f"{k}", data=v)
+                group.create_dataset(f"{k}", data=v, **_dataset_options(v.shape, v.dtype))
+        elif name == "rep_tensor" and np.ndim(data) == 4 and np.isrealobj(data):
+            # Only the unique elements under the 8-fold permutational symmetry are stored,
+            # the loader restores the full tensor
+            data = restore(8, data, data.shape[0])
+            mol_group.create_dataset(name, data=data, **_dataset_options(data.shape, data.dtype))
         else:
-            mol_group.create_dataset(name, data=data)
+            data = np.asarray(data)
+            mol_group.create_dataset(name, data=data, **_dataset_options(data.shape, data.dtype))
+
+
+def _to_single_precision(array: np.ndarray) -> np.ndarray:
+    return array.astype(np.float32 if np.isrealobj(array) else np.complex64)
 
 
 def save_molecule_chi(
@@ -616,23 +780,50 @@ def save_molecule_chi(
     grid_coords = molecule.grid.coords
     mol = mol_from_Molecule(molecule)
 
-    chunks = (
-        (np.ceil(grid_coords.shape[0] / chunk_size).astype(int), 1, 1, 1) if chunk_size else None
-    )
     shape = (grid_coords.shape[0], len(omegas), molecule.rdm1.shape[0], molecule.ao.shape[1])
     # Remember that molecule.rdm1.shape[0] represents the spin
 
     if chunk_size is None:
         chunk_size = grid_coords.shape[0]
 
-    chi = generate_chi_tensor(
-        molecule.rdm1, molecule.ao, molecule.grid.coords, mol, omegas=omegas, precision=precision
+    # chi is written chunk by chunk as it is computed, so only one chunk is held in memory
+    chi = mol_group.create_dataset(
+        f"chi", shape=shape, dtype="float64", **_dataset_options(shape, np.dtype("float64"))
     )
-
-    mol_group.create_dataset(f"chi", shape=shape, chunks=chunks, dtype="float64", data=chi)
+    for chunk_index, end_index, nu_stack in _nu_stacks(mol, grid_coords, omegas, chunk_size):
+        chi_chunk = _chi_chunk(
+            molecule.rdm1, molecule.ao[chunk_index:end_index], nu_stack, precision=precision
+        )
+        chi[chunk_index:end_index] = device_get(chi_chunk)
     mol_group.create_dataset(f"omegas", data=omegas)
 
 
+# Chunk cache used when opening HDF5 files, large enough to hold many ~1 MiB chunks
+_HDF5_CACHE = dict(rdcc_nbytes=64 * 1024**2, rdcc_nslots=1048577, rdcc_w0=0.75)
+
+
+def _chunk_shape(shape: Tuple[int, ...], itemsize: int, target_nbytes: int = 1024**2) -> Tuple[int, ...]:
+    r"""Chunk shape of about `target_nbytes`, made of whole slabs of the trailing axes,
+    so that a chunk is contiguous in memory and slicing along the leading axis is cheap."""
+    chunks = list(shape)
+    for axis in range(len(shape)):
+        slab_nbytes = int(np.prod(shape[axis + 1 :], dtype=np.int64)) * itemsize
+        if slab_nbytes <= target_nbytes:
+            chunks[axis] = int(min(shape[axis], max(1, target_nbytes // max(slab_nbytes, 1))))
+            break
+        chunks[axis] = 1
+    return tuple(chunks)
+
+
+def _dataset_options(shape: Tuple[int, ...], dtype: np.dtype) -> Dict:
+    r"""Storage options for an HDF5 dataset: large numerical arrays are chunked and
+    compressed with lzf, which ships with h5py; small ones are stored contiguously."""
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    if len(shape) == 0 or dtype.kind not in "biufc" or nbytes < 64 * 1024:
+        return {}
+    return dict(chunks=_chunk_shape(shape, dtype.itemsize), compression="lzf", shuffle=True)
+
+
 ##############################################################################################################
 
 
@@ -640,18 +831,33 @@ def to_device_arrays(*arrays, dtype: Optional[DType] = None):
     if dtype is None:
         dtype = default_dtype()
 
+    # Arrays are gathered on the host and moved to the device with a single transfer
+    as_host = lambda array: array if isinstance(array, Array) else _from_external_array(array)
     out = []
     for array in arrays:
         if isinstance(array, dict):
-            for k, v in array.items():
-                array[k] = jnp.asarray(v)
-            out.append(array)
-        elif isinstance(array, Scalar):
+            out.append({k: as_host(v) for k, v in array.items()})
+        elif isinstance(array, Scalar) or array is None:
             out.append(array)
         else:
-            out.append(jnp.asarray(array))
+            out.append(as_host(array))
+
+    return list(device_put(tuple(out)))
+
 
-    return out
+def _from_external_array(array) -> Union[Array, np.ndarray]:
+    r"""Converts an array returned by PySCF to a NumPy array, or to a JAX array if it lives on a GPU.
+
+    GPU arrays, such as the CuPy arrays returned by GPU backends of PySCF (e.g. gpu4pyscf),
+    are shared with JAX through DLPack without a round trip through the host. If JAX cannot
+    use the array's device, it is copied to the host instead.
+    """
+    if hasattr(array, "__cuda_array_interface__"):
+        try:
+            return from_dlpack(array)
+        except (RuntimeError, TypeError):
+            return array.get()
+    return np.asarray(array)
 
 
 def _maybe_run_kernel(mf: HartreeFock, grids: Optional[Grids] = None):
@@ -694,15 +900,7 @@ def ao_grads(mol: Mole, coords: Array, order=2) -> Dict:
     ao_ = numint.eval_ao(mol, coords, deriv=order)
     if order == 0:
         return ao_[0]
-    result = {}
-    i = 4
-    for n in range(2, order + 1):
-        result[n] = jnp.empty((ao_[0].shape[0], ao_[0].shape[1], 0))
-        for c in combinations_with_replacement("xyz", r=n):
-            if len(set(c)) == 1:
-                result[n] = jnp.concatenate((result[n], jnp.expand_dims(ao_[i], axis=2)), axis=2)
-            i += 1
-    return result
+    return _pure_derivatives(ao_, order, axis=0)
 
 def pbc_ao_grads(cell: Cell, coords: Array, order=2, kpts=None) -> Dict:
     r"""Function to compute nth order crystal atomic orbital grads, for n > 1.
@@ -724,23 +922,28 @@ def pbc_ao_grads(cell: Cell, coords: Array, order=2, kpts=None) -> Dict:
         # Default is Gamma only
         ao_ = pbc_numint.eval_ao_kpts(cell, coords, kpts=np.zeros(3), deriv=order)
         ao_ = np.asarray(ao_)
-        aos = ao_[:, 0, :, :]
-        res_shape = (1, aos.shape[1], aos.shape[2], 0)
     else:
         ao_ = pbc_numint.eval_ao_kpts(cell, coords, kpts=kpts, deriv=order)
         ao_ = np.asarray(ao_)
-        aos = ao_[:, 0, :, :]
-        res_shape = (kpts.shape[0], aos.shape[1], aos.shape[2], 0)
     if order == 0:
         return ao_
+    return _pure_derivatives(ao_, order, axis=1)
+
+
+def _pure_derivatives(ao_: np.ndarray, order: int, axis: int) -> Dict:
+    r"""Gathers the derivatives of order 1 < n <= `order` along a single cartesian coordinate
+    from the output of PySCF's `eval_ao`, whose derivative components lie along `axis`.
+    Each order is gathered on the host in a single indexing operation, and stacked along a new last axis.
+    """
     result = {}
     i = 4
     for n in range(2, order + 1):
-        result[n] = jnp.empty(res_shape)
+        indices = []
         for c in combinations_with_replacement("xyz", r=n):
             if len(set(c)) == 1:
-                result[n] = jnp.concatenate((result[n], jnp.expand_dims(ao_[:, i, :, :], axis=3)), axis=3)
+                indices.append(i)
             i += 1
+        result[n] = np.moveaxis(np.take(ao_, indices, axis=axis), axis, -1)
     return result
 
 def calc_eri_with_pyscf(mf, kpts=np.zeros(3)) -> np.ndarray:
@@ -760,6 +963,12 @@ def calc_eri_with_pyscf(mf, kpts=np.zeros(3)) -> np.ndarray:
     
     The ERIs. Output shape is (nao, nao, nao, nao) for isolated molecules and gamma-point only
     periodic calculations. For full BZ calculations, the output shape is (nkpt, nkpt, nao, nao, nao, nao).
+
+    Notes
+    ----------
+    For isolated molecules, the exact four-center integrals are computed unless the mean field
+    object is density fitted (e.g. ``mf = dft.RKS(mol).density_fit()``), in which case the
+    ERIs are assembled from its three-center integrals. This is much cheaper for large basis sets.
     """
     # Solid or Isolated molecule?
     if hasattr(mf, "cell"): # Periodic system
@@ -791,13 +1000,11 @@ def calc_eri_with_pyscf(mf, kpts=np.zeros(3)) -> np.ndarray:
                 eri[ikpt, jkpt, :, :, :, :] = eri_kquartet
                 
     else: # Isolated system
-        try:
-            _ = mf.with_df
-        except(AttributeError):
-            eri =  mf.mol.intor("int2e")
-            return eri
-        # Use default DF method when DF is used on molecules
-        density_fitter = df.DF(mf.mol)
+        density_fitter = getattr(mf, "with_df", None)
+        if density_fitter is None:
+            return _molecular_eri(mf.mol)
+        # Reuse the density fitting object of the calculation, which keeps its auxiliary basis
+        # and three-center integrals, instead of evaluating the four-center integrals
         eri_compressed = density_fitter.get_eri()
         eri = restore(1, eri_compressed, mf.mol.nao_nr())
     return eri
@@ -805,6 +1012,26 @@ def calc_eri_with_pyscf(mf, kpts=np.zeros(3)) -> np.ndarray:
 
 
 
+# The packed ERIs of the molecules alive, see _molecular_eri
+_PACKED_ERIS = weakref.WeakKeyDictionary()
+
+
+def _molecular_eri(mol: Mole) -> np.ndarray:
+    r"""Computes the exact ERIs of a molecule, with shape (nao, nao, nao, nao).
+
+    Only the unique integrals under the 8-fold permutational symmetry are kept for each molecule,
+    so that converting several mean field calculations on the same molecule (e.g. with different
+    functionals) evaluates them only once. They are released together with the molecule, and
+    checked against its integral parameters in case it was modified in place.
+    """
+    key = (mol._atm.tobytes(), mol._bas.tobytes(), mol._env.tobytes(), mol.cart)
+    cached_key, eri = _PACKED_ERIS.get(mol, (None, None))
+    if cached_key != key:
+        eri = mol.intor("int2e", aosym="s8")
+        _PACKED_ERIS[mol] = (key, eri)
+    return restore(1, eri, mol.nao_nr())
+
+
 def _package_outputs(
     mf: DensityFunctional,
     grids: Optional[Grids] = None,
@@ -821,10 +1048,10 @@ def _package_outputs(
     
     # Restricted (non-spin polarized), open boundary conditions
     if rdm1.ndim == 2 and not hasattr(mf, "cell"):
-        ao_and_1deriv = numint.eval_ao(mf.mol, grids.coords, deriv=1)  # , non0tab=grids.non0tab)
+        ao_and_1deriv = numint.eval_ao(mf.mol, grids.coords, deriv=1, non0tab=grids.non0tab)
         ao = ao_and_1deriv[0]
         grad_ao = ao_and_1deriv[1:4].transpose(1, 2, 0)
-        grad_n_ao = ao_grads(mf.mol, jnp.array(mf.grids.coords), order=grad_order)
+        grad_n_ao = ao_grads(mf.mol, mf.grids.coords, order=grad_order)
         s1e = mf.get_ovlp(mf.mol)
         h1e = mf.get_hcore(mf.mol)
         half_dm = rdm1 / 2
@@ -836,9 +1063,11 @@ def _package_outputs(
         mo_coeff = np.stack([half_mo_coeff, half_mo_coeff], axis=0)
         mo_energy = np.stack([half_mo_energy, half_mo_energy], axis=0)
         mo_occ = np.stack([half_mo_occ, half_mo_occ], axis=0)
+        # Both spin channels are equal, so J is built once
         vj = 2 * mf.get_j(
-        mf.mol, rdm1, hermi=1
+        mf.mol, half_dm, hermi=1
         )  # The 2 is to compensate for the /2 in the definition of the density matrix
+        vj = np.stack([vj, vj], axis=0)
         dm = mf.make_rdm1(mf.mo_coeff, mf.mo_occ)
         fock = np.stack([h1e, h1e], axis=0) + mf.get_veff(mf.mol, dm)
         rep_tensor = calc_eri_with_pyscf(mf)
@@ -846,10 +1075,10 @@ def _package_outputs(
         
     # Unrestricted (spin polarized), open boundary conditions
     elif rdm1.ndim == 3 and not hasattr(mf, "cell"):
-        ao_and_1deriv = numint.eval_ao(mf.mol, grids.coords, deriv=1)  # , non0tab=grids.non0tab)
+        ao_and_1deriv = numint.eval_ao(mf.mol, grids.coords, deriv=1, non0tab=grids.non0tab)
         ao = ao_and_1deriv[0]
         grad_ao = ao_and_1deriv[1:4].transpose(1, 2, 0)
-        grad_n_ao = ao_grads(mf.mol, jnp.array(mf.grids.coords), order=grad_order)
+        grad_n_ao = ao_grads(mf.mol, mf.grids.coords, order=grad_order)
         s1e = mf.get_ovlp(mf.mol)
         h1e = mf.get_hcore(mf.mol)
         mo_coeff = np.stack(mf.mo_coeff, axis=0)
@@ -859,7 +1088,7 @@ def _package_outputs(
             mf.mol, rdm1, hermi=1
         )  # The 2 is to compensate for the /2 in the definition of the density matrix
         dm = mf.make_rdm1(mf.mo_coeff, mf.mo_occ)
-        fock = np.stack([h1e, h1e], axis=0) + mf.get_veff(mf.mol, dm)
+        fock = h1e[None] + mf.get_veff(mf.mol, dm)
         rep_tensor = calc_eri_with_pyscf(mf)
         kpt_info = None
      
@@ -869,8 +1098,8 @@ def _package_outputs(
         ao_and_1deriv = np.asarray(ao_and_1deriv)
         ao = ao_and_1deriv[:, 0, :, :]
         grad_ao = ao_and_1deriv[:, 1:4, :, :].transpose(0, 2, 3, 1)
-        grad_n_ao = pbc_ao_grads(mf.cell, jnp.array(mf.grids.coords), order=grad_order, kpts=mf.kpts)
-        # grad_n_ao = ao_grads(mf.mol, jnp.array(mf.grids.coords), order=grad_order)
+        grad_n_ao = pbc_ao_grads(mf.cell, mf.grids.coords, order=grad_order, kpts=mf.kpts)
+        # grad_n_ao = ao_grads(mf.mol, mf.grids.coords, order=grad_order)
         s1e = mf.get_ovlp(mf.mol)
         h1e = mf.get_hcore(mf.mol)
         
@@ -884,9 +1113,11 @@ def _package_outputs(
         mo_energy = np.stack([half_mo_energy, half_mo_energy], axis=0)
         mo_occ = np.stack([half_mo_occ, half_mo_occ], axis=0)
         
+        # Both spin channels are equal, so J is built once
         vj = 2 * mf.get_j(
-        mf.mol, rdm1, hermi=1
+        mf.mol, half_dm, hermi=1
         )  # The 2 is to compensate for the /2 in the definition of the density matrix
+        vj = np.stack([vj, vj], axis=0)
         dm = mf.make_rdm1(mf.mo_coeff, mf.mo_occ)
         fock = np.stack([h1e, h1e], axis=0) + mf.get_veff(mf.mol, dm)
         
@@ -901,7 +1132,7 @@ def _package_outputs(
         ao_and_1deriv = np.asarray(ao_and_1deriv)
         ao = ao_and_1deriv[:, 0, :, :]
         grad_ao = ao_and_1deriv[:, 1:4, :, :].transpose(0, 2, 3, 1)
-        grad_n_ao = pbc_ao_grads(mf.cell, jnp.array(mf.grids.coords), order=grad_order, kpts=mf.kpts)
+        grad_n_ao = pbc_ao_grads(mf.cell, mf.grids.coords, order=grad_order, kpts=mf.kpts)
         
         s1e = mf.get_ovlp(mf.mol)
         h1e = mf.get_hcore(mf.mol)
@@ -914,7 +1145,7 @@ def _package_outputs(
         )
         
         dm = mf.make_rdm1(mf.mo_coeff, mf.mo_occ)
-        fock = np.stack([h1e, h1e], axis=0) + mf.get_veff(mf.mol, dm)
+        fock = h1e[None] + mf.get_veff(mf.mol, dm)
         
         kpt_info = kpt_info_from_pyscf(mf)
         # Compute ERIs for all pairs of k-points. Needed for Coulomb energy calculation
@@ -926,7 +1157,7 @@ def _package_outputs(
         ao_and_1deriv = np.asarray(ao_and_1deriv)
         ao = ao_and_1deriv[:, 0, :, :]
         grad_ao = ao_and_1deriv[:, 1:4, :, :].transpose(0, 2, 3, 1)
-        grad_n_ao = pbc_ao_grads(mf.cell, jnp.array(mf.grids.coords), order=grad_order)
+        grad_n_ao = pbc_ao_grads(mf.cell, mf.grids.coords, order=grad_order)
         # Collapse the redundant extra dimension from k-points: gamma only
         ao = np.squeeze(ao, axis=0)
         grad_ao = np.squeeze(grad_ao, axis=0)
@@ -947,9 +1178,11 @@ def _package_outputs(
         half_mo_occ = mo_occ / 2
 
         rdm1 = np.stack([half_dm, half_dm], axis=0)
+        # Both spin channels are equal, so J is built once
         vj = 2 * mf.get_j(
-        mf.mol, rdm1, hermi=1
+        mf.mol, half_dm, hermi=1
         )  # The 2 is to compensate for the /2 in the definition of the density matrix
+        vj = np.stack([vj, vj], axis=0)
         rdm1 = np.squeeze(rdm1, axis=1)
         mo_coeff = np.stack([half_mo_coeff, half_mo_coeff], axis=0)
         mo_energy = np.stack([half_mo_energy, half_mo_energy], axis=0)
@@ -971,7 +1204,7 @@ def _package_outputs(
         ao_and_1deriv = np.asarray(ao_and_1deriv)
         ao = ao_and_1deriv[:, 0, :, :]
         grad_ao = ao_and_1deriv[:, 1:4, :, :].transpose(0, 2, 3, 1)
-        grad_n_ao = pbc_ao_grads(mf.cell, jnp.array(mf.grids.coords), order=grad_order)
+        grad_n_ao = pbc_ao_grads(mf.cell, mf.grids.coords, order=grad_order)
 
         # Collapse the redundant extra dimension from k-points: gamma only
         for key in grad_n_ao.keys():
@@ -997,7 +1230,7 @@ def _package_outputs(
         mo_occ = np.stack(mo_occ, axis=1).T
         
         dm = mf.make_rdm1(mf.mo_coeff, mf.mo_occ)
-        fock = np.stack([h1e, h1e], axis=0) + mf.get_veff(mf.mol, dm)
+        fock = h1e[None] + mf.get_veff(mf.mol, dm)
         fock = np.squeeze(fock, axis=1)
         vj = np.squeeze(vj, axis=1)
         h1e = np.squeeze(h1e, axis=0)
@@ -1105,22 +1338,97 @@ def generate_chi_tensor(
     chi : Array
         Xa^σ = Γbd^σ ψb(r) ∫ dr' f(|r-r'|) ψa(r') ψd(r')
         Expected shape: (n_grid_points, n_omegas, n_spin, n_orbitals)
+
+    Notes
+    ----------
+    The nu integrals of a chunk are held in memory for all omegas at the same time,
+    so the memory used per chunk grows linearly with the number of omegas.
     """
 
-    def chi_make(dm_, ao_, nu):
-        return jnp.einsum("...bd,b,da->...a", dm_, ao_, nu, precision=precision)
+    if len(omegas) == 0:
+        return jnp.array([])
 
-    chi = []
-    for omega in omegas:
-        chi_omega = []
-        for chunk_index, end_index, nu_chunk in _nu_chunk(mol, grid_coords, omega, chunk_size):
-            chi_chunk = vmap(chi_make, in_axes=(None, 0, 0), out_axes=0)(
-                rdm1, ao[chunk_index:end_index], nu_chunk
-            )
-            chi_omega.append(chi_chunk)
-        chi_omega = jnp.concatenate(chi_omega, axis=0)
-        chi.append(chi_omega)
-    if chi:
-        return jnp.stack(chi, axis=1)
-    else:
-        return jnp.array(chi)
+    rdm1 = jnp.asarray(rdm1)
+    chi = jnp.zeros(
+        (len(grid_coords), len(omegas)) + rdm1.shape[:-2] + rdm1.shape[-1:],
+        dtype=jnp.result_type(rdm1, ao),
+    )
+
+    # Written into the preallocated chi in place; as the dispatch is asynchronous,
+    # PySCF evaluates the next chunk of nu integrals meanwhile.
+    for chunk_index, end_index, nu_stack in _nu_stacks(mol, grid_coords, omegas, chunk_size):
+        ao_chunk = device_put(ao[chunk_index:end_index])
+        chi = _update_chi(chi, chunk_index, rdm1, ao_chunk, nu_stack, precision=precision)
+    return chi
+
+
+def _nu_stacks(mol: Mole, grid_coords: Array, omegas: Sequence[Scalar], chunk_size: int):
+    r"""Yields the nu integrals of all omegas chunk by chunk over the grid, so that each
+    chunk can be contracted for every omega at once. Each chunk is sent to the device
+    in a single transfer.
+
+    Yields
+    ----------
+    chunk_index, end_index, nu_stack
+        where nu_stack has shape (n_omegas, end_index - chunk_index, n_orbitals, n_orbitals).
+    """
+    nu_chunks = zip(*[_nu_chunk(mol, grid_coords, omega, chunk_size) for omega in omegas])
+    for chunks in nu_chunks:
+        chunk_index, end_index, _ = chunks[0]
+        nu_stack = device_put(np.stack([nu_chunk for _, _, nu_chunk in chunks], axis=0))
+        yield chunk_index, end_index, nu_stack
+
+
+@partial(jit, static_argnames=["precision"])
+def _chi_chunk(
+    rdm1: Array, ao_chunk: Array, nu_stack: Array, precision: Precision = Precision.HIGHEST
+) -> Array:
+    r"""Contracts a chunk of nu integrals, stacked over omegas, into a chunk of the chi tensor.
+
+    Parameters
+    ----------
+    rdm1: Array
+        Expected shape: (n_spin, n_orbitals, n_orbitals)
+    ao_chunk: Array
+        Expected shape: (chunk_size, n_orbitals)
+    nu_stack: Array
+        Expected shape: (n_omegas, chunk_size, n_orbitals, n_orbitals)
+
+    Returns
+    ----------
+    Array
+        Expected shape: (chunk_size, n_omegas, n_spin, n_orbitals)
+    """
+    # Contracting the orbitals with the density matrix first keeps the intermediate
+    # at O(chunk * n_orbitals) and turns both steps into matrix products
+    ao_dm = jnp.einsum("...bd,gb->g...d", rdm1, ao_chunk, precision=precision)
+    return jnp.einsum("g...d,ogda->go...a", ao_dm, nu_stack, precision=precision)
+
+
+@partial(jit, static_argnames=["precision"], donate_argnums=(0,))
+def _update_chi(
+    chi: Array,
+    chunk_index: Int[Array, ""],
+    rdm1: Array,
+    ao_chunk: Array,
+    nu_stack: Array,
+    precision: Precision = Precision.HIGHEST,
+) -> Array:
+    r"""Contracts a chunk of nu integrals into the chi tensor, see `_chi_chunk`.
+
+    Parameters
+    ----------
+    chi: Array
+        The chi tensor being filled. Its buffer is donated.
+        Expected shape: (n_grid_points, n_omegas, n_spin, n_orbitals)
+    chunk_index: Int[Array, ""]
+        The index of the first grid point of the chunk.
+
+    Returns
+    ----------
+    Array
+        chi, with the grid points of the chunk filled in.
+    """
+    chi_chunk = _chi_chunk(rdm1, ao_chunk, nu_stack, precision=precision)
+    start = (chunk_index,) + (0,) * (chi.ndim - 1)
+    return dynamic_update_slice(chi, chi_chunk.astype(chi.dtype), start)
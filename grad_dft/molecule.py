@@ -12,11 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License. 
 
-from typing import List, Optional, Union, Sequence, Tuple, NamedTuple
+from typing import Callable, List, Optional, Union, Sequence, Tuple, NamedTuple
 from dataclasses import fields
 
 from typeguard import typechecked
-from grad_dft.utils import vmap_chunked
+from grad_dft.utils import vmap_chunked, einsum_path
 from functools import partial
 
 from jax import numpy as jnp
@@ -24,6 +24,7 @@ from jax import scipy as jsp
 from jax.lax import Precision
 from jax import vmap, grad
 from jax.lax import fori_loop, cond
+from jax.custom_derivatives import SymbolicZero
 from flax import struct
 from flax import linen as nn
 import jax 
@@ -100,11 +101,26 @@ class Molecule:
     grid_level: Optional[Scalar] = 2
     scf_iteration: Optional[Scalar] = 50
     fock: Optional[Array] = None
+    fock_norm: Optional[Scalar] = None  # Frobenius norm of the target fock, used in regularization
+    # Static: the spin channels of rdm1 are equal, so features are computed from the first one.
+    # Set it to False with `replace` before using a density matrix whose spin channels differ
+    is_restricted: bool = struct.field(pytree_node=False, default=False)
 
     @property
     def grid_size(self):
         return len(self.grid)
-    
+
+    def _spin_features(self, feature: Callable, *arrays: Array, **kwargs) -> Array:
+        r"""Evaluates `feature(self.rdm1, *arrays, **kwargs)`, a function linear in the density matrix.
+
+        For a restricted molecule, the feature is evaluated on the first spin channel and
+        broadcast to all of them (axis 1). The derivatives are still propagated through each
+        spin channel, so the Fock matrices are exact also for functionals that are not spin symmetric.
+        """
+        if not self.is_restricted:
+            return feature(self.rdm1, *arrays, **kwargs)
+        return _restricted_feature(partial(feature, **kwargs), self.rdm1, *arrays)
+
     def get_coulomb_potential(self, *args, **kwargs) -> Float[Array, "orbitals orbitals"]:
         r"""Compute the Coulomb potential matrix.
 
@@ -121,7 +137,7 @@ class Molecule:
         -------
         Float[Array, "grid spin"]
         """
-        return density(self.rdm1, self.ao, *args, **kwargs)
+        return self._spin_features(density, self.ao, *args, **kwargs)
 
     def grad_density(self, *args, **kwargs) -> Array:
         r""" Computes the gradient of the electronic density of a molecule at each grid point.
@@ -130,7 +146,7 @@ class Molecule:
         -------
         Float[Array, "grid spin 3"]
         """
-        return grad_density(self.rdm1, self.ao, self.grad_ao, *args, **kwargs)
+        return self._spin_features(grad_density, self.ao, self.grad_ao, *args, **kwargs)
 
     def lapl_density(self, *args, **kwargs) -> Array:
         r""" Computes the laplacian of the electronic density of a molecule at each grid point.
@@ -139,7 +155,9 @@ class Molecule:
         -------
         Float[Array, "grid spin"]
         """
-        return lapl_density(self.rdm1, self.ao, self.grad_ao, self.grad_n_ao[2], *args, **kwargs)
+        return self._spin_features(
+            lapl_density, self.ao, self.grad_ao, self.grad_n_ao[2], *args, **kwargs
+        )
 
     def kinetic_density(self, *args, **kwargs) -> Array:
         r""" Computes the kinetic energy density of a molecule at each grid point.
@@ -148,7 +166,7 @@ class Molecule:
         -------
         Float[Array, "grid spin"]
         """
-        return kinetic_density(self.rdm1, self.grad_ao, *args, **kwargs)
+        return self._spin_features(kinetic_density, self.grad_ao, *args, **kwargs)
 
     def select_HF_omegas(self, omegas: Float[Array, "omega"]) -> Array:
         r""" Selects the chi tensor according to the omegas passed.
@@ -165,6 +183,7 @@ class Molecule:
         Returns
         ----------
         chi: Float[Array, "grid omega spin orbitals"]
+            NaN for the omegas missing from `self.omegas` if they are traced, e.g. under `jax.jit`.
 
         .. math::
             Xc^{ω,σ} = Γbd^σ ψb(r) ∫ dr' f_{ω}(|r-r'|) ψc(r') ψd(r') = Γbd^σ ψb(r) v_{cd}(r)
@@ -173,14 +192,16 @@ class Molecule:
 
         if self.chi is None:
             raise ValueError("Precomputed chi tensor has not been loaded.")
-        for o in omegas:
-            if o not in self.omegas:
-                raise ValueError(
-                    f"The molecule.chi tensor does not contain omega value {o}, only {self.omegas}"
-                )
-        indices = [list(self.omegas).index(o) for o in omegas]
-        chi = jnp.stack([self.chi[:, i] for i in indices], axis=1)
-        return chi
+        omegas = jnp.atleast_1d(jnp.asarray(omegas))
+        matches = jnp.isclose(omegas[:, None], jnp.asarray(self.omegas)[None, :])
+        found = matches.any(axis=1)
+        if not isinstance(found, jax.core.Tracer) and not found.all():
+            raise ValueError(
+                f"The molecule.chi tensor does not contain omega values {omegas}, only {self.omegas}"
+            )
+        indices = jnp.argmax(matches, axis=1)
+        # When traced, the chi tensor of a missing omega is set to NaN instead of raising
+        return jnp.where(found[:, None, None], jnp.take(self.chi, indices, axis=1), jnp.nan)
 
     def HF_energy_density(self, omegas: Float[Array, "omega"], *args, **kwargs) -> Array:
         r""" Computes the Hartree-Fock energy density of a molecule at each grid point,
@@ -378,7 +399,9 @@ def orbital_grad(
     C_occ = jax.vmap(jnp.where, in_axes=(None, 1, None), out_axes=1)(mo_occ > 0, mo_coeff, 0)
     C_vir = jax.vmap(jnp.where, in_axes=(None, 1, None), out_axes=1)(mo_occ == 0, mo_coeff, 0)
 
-    return jnp.einsum("sab,sac,scd->bd", C_vir.conj(), F, C_occ, precision = precision)
+    subscripts = "sab,sac,scd->bd"
+    path = einsum_path(subscripts, C_vir.shape, F.shape, C_occ.shape)
+    return jnp.einsum(subscripts, C_vir.conj(), F, C_occ, optimize=path, precision = precision)
 
 
 ##########################################################
@@ -406,7 +429,9 @@ def density(rdm1: Float[Array, "spin orbitals orbitals"],
     Float[Array, "grid spin"]
     """
 
-    return jnp.einsum("...ab,ra,rb->r...", rdm1, ao, ao, precision=precision)
+    subscripts = "...ab,ra,rb->r..."
+    path = einsum_path(subscripts, rdm1.shape, ao.shape, ao.shape)
+    return jnp.einsum(subscripts, rdm1, ao, ao, optimize=path, precision=precision)
 
 @jaxtyped
 @typechecked
@@ -437,7 +462,9 @@ def grad_density(
         The density gradient. Shape: (n_grid_points, n_spin, 3)
     """
 
-    return 2 * jnp.einsum("...ab,ra,rbj->r...j", rdm1, ao, grad_ao, precision=precision)
+    subscripts = "...ab,ra,rbj->r...j"
+    path = einsum_path(subscripts, rdm1.shape, ao.shape, grad_ao.shape)
+    return 2 * jnp.einsum(subscripts, rdm1, ao, grad_ao, optimize=path, precision=precision)
 
 @jaxtyped
 @typechecked
@@ -469,9 +496,13 @@ def lapl_density(
     -------
     Float[Array, "grid spin"]
     """
+    kinetic_subscripts = "...ab,raj,rbj->r..."
+    kinetic_path = einsum_path(kinetic_subscripts, rdm1.shape, grad_ao.shape, grad_ao.shape)
+    lapl_subscripts = "...ab,ra,rbi->r..."
+    lapl_path = einsum_path(lapl_subscripts, rdm1.shape, ao.shape, grad_2_ao.shape)
     return 2 * jnp.einsum(
-        "...ab,raj,rbj->r...", rdm1, grad_ao, grad_ao, precision=precision
-    ) + 2 * jnp.einsum("...ab,ra,rbi->r...", rdm1, ao, grad_2_ao, precision=precision)
+        kinetic_subscripts, rdm1, grad_ao, grad_ao, optimize=kinetic_path, precision=precision
+    ) + 2 * jnp.einsum(lapl_subscripts, rdm1, ao, grad_2_ao, optimize=lapl_path, precision=precision)
 
 @jaxtyped
 @typechecked
@@ -499,7 +530,9 @@ def kinetic_density(
         The kinetic energy density. Shape: (n_spin, n_grid_points)
     """
 
-    return 0.5 * jnp.einsum("...ab,raj,rbj->r...", rdm1, grad_ao, grad_ao, precision=precision)
+    subscripts = "...ab,raj,rbj->r..."
+    path = einsum_path(subscripts, rdm1.shape, grad_ao.shape, grad_ao.shape)
+    return 0.5 * jnp.einsum(subscripts, rdm1, grad_ao, grad_ao, optimize=path, precision=precision)
 
 @jaxtyped
 @typechecked
@@ -700,6 +733,7 @@ def nonXC(
     rep_tensor: Float[Array, "orbitals orbitals orbitals orbitals"],
     nuclear_repulsion: Scalar,
     precision=Precision.HIGHEST,
+    v_coul: Optional[Float[Array, "orbitals orbitals"]] = None,
 ) -> Scalar:
     r""" A function that computes the non-XC part of a DFT functional.
 
@@ -719,6 +753,8 @@ def nonXC(
         Equivalent to mf.mol.energy_nuc() in pyscf.
     precision : Precision, optional
         The precision to use for the computation, by default Precision.HIGHEST
+    v_coul : Float[Array, "orbitals orbitals"], optional
+        The Coulomb potential of `rdm1`, if already computed. See `coulomb_energy`.
 
     Returns
     -------
@@ -726,7 +762,7 @@ def nonXC(
     """
     h1e_energy = one_body_energy(rdm1, h1e, precision)
     # jax.debug.print("h1e_energy is {x}", x=h1e_energy)
-    coulomb2e_energy = coulomb_energy(rdm1, rep_tensor, precision)
+    coulomb2e_energy = coulomb_energy(rdm1, rep_tensor, precision, v_coul)
     # jax.debug.print("coulomb2e_energy is {x}", x=coulomb2e_energy)
     # jax.debug.print("nuclear_repulsion is {x}", x=nuclear_repulsion)
 
@@ -764,6 +800,7 @@ def coulomb_energy(
     rdm1: Float[Array, "orbitals orbitals"],
     rep_tensor: Float[Array, "orbitals orbitals orbitals orbitals"],
     precision=Precision.HIGHEST,
+    v_coul: Optional[Float[Array, "orbitals orbitals"]] = None,
 ) -> Scalar:
     r"""A function that computes the Coulomb two-body energy of a DFT functional.
     
@@ -773,12 +810,16 @@ def coulomb_energy(
         The 1-Reduced Density Matrix.
     rep_tensor : Float[Array, "orbitals orbitals orbitals orbitals"]
         The repulsion tensor.
+    v_coul : Float[Array, "orbitals orbitals"], optional
+        The Coulomb potential of `rdm1`. If it has already been computed (e.g. for the
+        Fock matrix), passing it avoids contracting the repulsion tensor a second time.
 
     Returns
     -------
     Scalar
     """
-    v_coul = coulomb_potential(rdm1, rep_tensor, precision)
+    if v_coul is None:
+        v_coul = coulomb_potential(rdm1, rep_tensor, precision)
     coulomb2e_energy = jnp.einsum("pq,pq->", rdm1, v_coul, precision=precision) / 2.0
     return coulomb2e_energy
 
@@ -843,7 +884,9 @@ def make_rdm1(
     return jnp.array((dm_a, dm_b))
     """
 
-    return jnp.einsum("sij,sj,skj -> sik", mo_coeff, mo_occ, mo_coeff.conj(), precision=precision)
+    subscripts = "sij,sj,skj->sik"
+    path = einsum_path(subscripts, mo_coeff.shape, mo_occ.shape, mo_coeff.shape)
+    return jnp.einsum(subscripts, mo_coeff, mo_occ, mo_coeff.conj(), optimize=path, precision=precision)
 
 @jaxtyped
 @typechecked
@@ -889,6 +932,83 @@ def get_occ(
     return mo_occ
 
 
+@partial(jax.custom_jvp, nondiff_argnums=(0,))
+def _restricted_feature(feature: Callable, rdm1: Array, *arrays: Array) -> Array:
+    r"""Evaluates the spin-resolved `feature` on the first spin channel of `rdm1` only."""
+    features = feature(rdm1[:1], *arrays)
+    shape = list(features.shape)
+    shape[1] = rdm1.shape[0]
+    return jnp.broadcast_to(features, shape)
+
+
+def _restricted_feature_jvp(feature, primals, tangents):
+    # The features are linear in rdm1, so its tangent is mapped through the feature
+    # without recomputing the primal, and separately for each spin channel
+    rdm1, *arrays = primals
+    t_rdm1, *t_arrays = tangents
+    t_features = None
+    if not isinstance(t_rdm1, SymbolicZero):
+        t_features = feature(t_rdm1, *arrays)
+    if not all(isinstance(t, SymbolicZero) for t in t_arrays):
+        t_arrays = [
+            jnp.zeros_like(a) if isinstance(t, SymbolicZero) else t for t, a in zip(t_arrays, arrays)
+        ]
+        t_orbitals = jax.jvp(partial(feature, rdm1), arrays, t_arrays)[1]
+        t_features = t_orbitals if t_features is None else t_features + t_orbitals
+    features = _restricted_feature(feature, *primals)
+    if t_features is None:
+        t_features = jnp.zeros_like(features)
+    return features, t_features
+
+
+_restricted_feature.defjvp(_restricted_feature_jvp, symbolic_zeros=True)
+
+
+def pad_molecule_batch(molecules: Sequence[Molecule]) -> Molecule:
+    r""" Stacks a sequence of molecules into a single batched `Molecule`.
+
+    Every array field is zero-padded to the largest shape found in the batch
+    (number of grid points, orbitals, atoms...) and stacked along a new leading axis.
+    Padded grid points have zero weight and padded orbitals have zero coefficients,
+    occupations and density matrix elements, so they do not contribute to the energy,
+    the Fock matrix or the regularization terms.
+
+    Parameters
+    ----------
+    molecules : Sequence[Molecule]
+        The molecules to batch. Optional fields must be set (or left to None)
+        consistently across the batch.
+
+    Returns
+    -------
+    Molecule
+        A `Molecule` whose fields have a leading batch axis of size len(molecules).
+
+    Raises
+    ------
+    ValueError
+        If restricted and unrestricted molecules are mixed, since `is_restricted` is static.
+        Unrestricted features can be used for all of them with `molecule.replace(is_restricted=False)`.
+    """
+
+    if len({molecule.is_restricted for molecule in molecules}) > 1:
+        raise ValueError(
+            "Cannot batch restricted and unrestricted molecules together. "
+            "Use molecule.replace(is_restricted=False) on the restricted ones."
+        )
+
+    def pad_and_stack(*leaves):
+        leaves = [jnp.asarray(leaf) for leaf in leaves]
+        shape = tuple(max(sizes) for sizes in zip(*(leaf.shape for leaf in leaves)))
+        if not shape:
+            return jnp.stack(leaves)
+        return jnp.stack(
+            [jnp.pad(leaf, [(0, n - m) for n, m in zip(shape, leaf.shape)]) for leaf in leaves]
+        )
+
+    return jax.tree_util.tree_map(pad_and_stack, *molecules)
+
+
 ######################################################################
 
 
@@ -16,12 +16,13 @@ from typing import Callable, Optional, Tuple, Union
 from functools import partial
 from jaxtyping import Array, PRNGKeyArray, PyTree, Scalar, Float, Complex
 
-from jax import numpy as jnp, vmap
+from jax import jit, numpy as jnp, pmap, vmap
 from jax import value_and_grad, grad
 from jax.profiler import annotate_function
-from jax.lax import stop_gradient
+from jax.lax import pmean, scan, stop_gradient
 from optax import OptState, GradientTransformation, apply_updates
 
+from grad_dft.utils import DType
 from grad_dft import (
     coulomb_energy,
     DispersionFunctional, 
@@ -83,7 +84,36 @@ def energy_predictor(
     True
     """
     
-    @partial(value_and_grad, argnums=1)
+    # Which features are computed is fixed by the functional, so the branch is taken once here
+    density_features = _split_features(
+        functional.energy_densities, functional.nograd_densities, functional.combine_densities, **kwargs
+    )
+    cinput_features = _split_features(
+        functional.coefficient_inputs,
+        functional.nograd_coefficient_inputs,
+        functional.combine_inputs,
+        **kwargs,
+    )
+
+    def features(atoms: Union[Molecule, Solid], *args) -> Tuple[Optional[Array], ...]:
+        r"""
+        Computes the densities and coefficient inputs of the functional, keeping
+        the parts that should be autodifferentiated apart from the rest.
+
+        Parameters
+        ----------
+        atoms: Union[Molecule, Solid]
+            The collection of atoms.
+        *args
+
+        Returns
+        -------
+        Tuple[Optional[Array], ...]
+            densities, grad_densities, nograd_densities, cinputs, grad_cinputs, nograd_cinputs
+        """
+        return density_features(atoms, *args) + cinput_features(atoms, *args)
+
+    @partial(value_and_grad, argnums=1, has_aux=True)
     def xc_energy_and_grads(
         params: PyTree, 
         rdm1: Union[Float[Array, "spin orbitals orbitals"],
@@ -92,10 +122,13 @@ def energy_predictor(
         atoms: Union[Molecule, Solid], 
         *args, 
         **functional_kwargs
-    ) -> Scalar:
+    ) -> Tuple[Scalar, Tuple[Optional[Array], ...]]:
         r"""
         Computes the xc energy and gradients with respect to the density matrix.
 
+        The features are returned as auxiliary outputs so that the explicit
+        potential terms of the Fock matrix can reuse them.
+
         Parameters
         ----------
         params: Pytree
@@ -109,16 +142,18 @@ def energy_predictor(
 
         Returns
         -----------
-        Tuple[Scalar, Float[Array, "spin orbitals orbitals"]]
+        Tuple[Tuple[Scalar, Tuple[Optional[Array], ...]], Float[Array, "spin orbitals orbitals"]]
         """
         atoms = atoms.replace(rdm1=rdm1)
-        densities = functional.compute_densities(atoms, *args, **functional_kwargs)
-        cinputs = functional.compute_coefficient_inputs(atoms, *args)
+        atoms_features = features(atoms, *args)
+        densities, _, _, cinputs, _, _ = atoms_features
+        densities = abs_clip(densities, clip_cte)
+        e = functional.xc_energy(params, atoms.grid, cinputs, densities, **functional_kwargs)
         if nlc_functional:
             e = e + nlc_functional.energy(
                 {"params": params["dispersion"]}, atoms, **functional_kwargs
             )
-        return functional.xc_energy(params, atoms.grid, cinputs, densities, **functional_kwargs)
+        return e, atoms_features
 
     @partial(annotate_function, name="predict")
     def predict(params: PyTree, atoms: Union[Molecule, Solid], *args) -> Tuple[Scalar, Array]:
@@ -144,78 +179,175 @@ def energy_predictor(
             (*batch_size, n_spin, n_kpt, n_orbitals, n_orbitals) for a `Solid`.
         """
         
-        Exc, fock_xc = xc_energy_and_grads(params, atoms.rdm1, atoms, *args)
-        fock_noxc = atoms.h1e + atoms.get_coulomb_potential()
-        
-        energy = Exc + atoms.nonXC()
+        (Exc, atoms_features), fock_xc = xc_energy_and_grads(params, atoms.rdm1, atoms, *args)
+        v_coul = atoms.get_coulomb_potential()
+        fock_noxc = atoms.h1e + v_coul
         
         if isinstance(atoms, Molecule):
-            transpose_dims = (0, 2, 1)
+            # The Coulomb potential is shared with the energy, so the ERIs are contracted once
+            energy = Exc + atoms.nonXC(v_coul=v_coul)
             fock = fock_noxc + fock_xc
         elif isinstance(atoms, Solid):
-            transpose_dims = (0, 1, 3, 2)
+            energy = Exc + atoms.nonXC()
             # auto-diffed xc gradient is divided by n_k=number of k-points. Undo this.
             fock = fock_noxc + (fock_xc*atoms.rdm1.shape[1])
             
-        # Improve stability by clipping and symmetrizing
-        fock = abs_clip(fock, clip_cte)
-        fock = 1 / 2 * (fock + fock.transpose(transpose_dims).conj())
-        fock = abs_clip(fock, clip_cte)
-        
-        # Compute the features that should be autodifferentiated
-        if functional.energy_densities and functional.densitygrads:
-            grad_densities = functional.energy_densities(atoms, *args, **kwargs)
-            nograd_densities = stop_gradient(functional.nograd_densities(atoms, *args, **kwargs))
-            densities = functional.combine_densities(grad_densities, nograd_densities)
-        elif functional.energy_densities:
-            grad_densities = functional.energy_densities(atoms, *args, **kwargs)
-            nograd_densities = None
-            densities = grad_densities
-        elif functional.densitygrads:
-            grad_densities = None
-            nograd_densities = stop_gradient(functional.nograd_densities(atoms, *args, **kwargs))
-            densities = nograd_densities
-        else:
-            densities, grad_densities, nograd_densities = None, None, None
-
-        if functional.coefficient_input_grads and functional.coefficient_inputs:
-            grad_cinputs = functional.coefficient_inputs(atoms, *args, **kwargs)
-            nograd_cinputs = stop_gradient(
-                functional.nograd_coefficient_inputs(atoms, *args, **kwargs)
-            )
-            cinputs = functional.combine_inputs(grad_cinputs, nograd_cinputs)
-        elif functional.coefficient_inputs:
-            grad_cinputs = functional.coefficient_inputs(atoms, *args, **kwargs)
-            nograd_cinputs = None
-            cinputs = grad_cinputs
-        elif functional.coefficient_input_grads:
-            grad_cinputs = None
-            nograd_cinputs = stop_gradient(
-                functional.nograd_coefficient_inputs(atoms, *args, **kwargs)
-            )
-            cinputs = nograd_cinputs
-        else:
-            cinputs, grad_cinputs, nograd_cinputs = None, None, None
+        # The features computed along with the energy are reused for the explicit potentials
+        (
+            densities, grad_densities, nograd_densities, cinputs, grad_cinputs, nograd_cinputs
+        ) = atoms_features
 
+        vxc_expls = []
         # Compute the derivatives with respect to nograd_densities
         if functional.densitygrads:
-            vxc_expl = functional.densitygrads(
-                functional, params, atoms, nograd_densities, cinputs, grad_densities
+            vxc_expls.append(
+                functional.densitygrads(
+                    functional, params, atoms, nograd_densities, cinputs, grad_densities
+                )
             )
-            fock += vxc_expl + vxc_expl.transpose(transpose_dims)  # Sum over omega
-            fock = abs_clip(fock, clip_cte)
 
         if functional.coefficient_input_grads:
-            vxc_expl = functional.coefficient_input_grads(
-                functional, params, atoms, nograd_cinputs, grad_cinputs, densities
+            vxc_expls.append(
+                functional.coefficient_input_grads(
+                    functional, params, atoms, nograd_cinputs, grad_cinputs, densities
+                )
             )
-            fock += vxc_expl + vxc_expl.transpose(transpose_dims)  # Sum over omega
-            fock = abs_clip(fock, clip_cte)
 
+        return energy, _postprocess_fock(fock, tuple(vxc_expls), clip_cte)
+
+    # The functional and keyword arguments are closed over, so they are fixed at trace time
+    return jit(predict)
+
+
+@partial(jit, static_argnames=["clip_cte"])
+def _postprocess_fock(
+    fock: Array, vxc_expls: Tuple[Array, ...], clip_cte: float = 1e-30
+) -> Array:
+    r"""Symmetrizes the Fock matrix and adds the explicit exchange-correlation potentials,
+    clipping in between to improve stability.
+
+    Gathering these elementwise steps in one function lets XLA fuse them into a single pass.
+
+    Parameters
+    ----------
+    fock : Array
+        The autodifferentiated Fock matrix, of shape (..., n_orbitals, n_orbitals).
+    vxc_expls : Tuple[Array, ...]
+        The explicit potentials (for instance from `Functional.densitygrads`), of the same shape.
+    clip_cte : float
+        The clipping constant.
+
+    Returns
+    -------
+    Array
+    """
+    fock = abs_clip(fock, clip_cte)
+    fock = 0.5 * (fock + jnp.swapaxes(fock, -1, -2).conj())
+    fock = abs_clip(fock, clip_cte)
+    for vxc_expl in vxc_expls:
+        fock = fock + vxc_expl + jnp.swapaxes(vxc_expl, -1, -2)  # Sum over omega
         fock = abs_clip(fock, clip_cte)
-        return energy, fock
+    return abs_clip(fock, clip_cte)
+
+
+def _split_features(
+    grad_features: Optional[Callable],
+    nograd_features: Optional[Callable],
+    combine: Optional[Callable],
+    **kwargs,
+) -> Callable:
+    r"""Builds the function computing a set of features of a functional, split into
+    the part that is autodifferentiated and the one that is not.
+
+    Parameters
+    ----------
+    grad_features : Optional[Callable]
+        Computes the features to autodifferentiate, e.g. `Functional.energy_densities`.
+    nograd_features : Optional[Callable]
+        Computes the features whose gradients are not autodifferentiated,
+        e.g. `Functional.nograd_densities`.
+    combine : Optional[Callable]
+        Combines both sets of features, e.g. `Functional.combine_densities`.
+    **kwargs
+        Keyword arguments forwarded to the feature functions.
+
+    Returns
+    -------
+    Callable
+        (atoms: Union[Molecule, Solid], *args) -> Tuple[features, grad_features, nograd_features],
+        where the entries that the functional does not define are None.
+    """
+
+    if grad_features and nograd_features:
+
+        def split_features(atoms, *args):
+            grad = grad_features(atoms, *args, **kwargs)
+            nograd = stop_gradient(nograd_features(atoms, *args, **kwargs))
+            return combine(grad, nograd), grad, nograd
+
+    elif grad_features:
+
+        def split_features(atoms, *args):
+            grad = grad_features(atoms, *args, **kwargs)
+            return grad, grad, None
+
+    elif nograd_features:
+
+        def split_features(atoms, *args):
+            nograd = stop_gradient(nograd_features(atoms, *args, **kwargs))
+            return nograd, None, nograd
+
+    else:
+
+        def split_features(atoms, *args):
+            return None, None, None
+
+    return split_features
+
+
+def batched_energy_predictor(
+    functional: Functional,
+    nlc_functional: Optional[DispersionFunctional] = None,
+    clip_cte: float = 1e-30,
+    **kwargs,
+) -> Callable:
+    r"""Generate a function that predicts the energies and Fock matrices
+    of a batch of molecules at once.
+
+    Parameters
+    ----------
+    functional : Functional
+        The exchange-correlation functional. See `energy_predictor`.
+    nlc_functional : Optional[DispersionFunctional]
+        The dispersion functional, if any.
+    clip_cte : float
+        The clipping constant used to stabilize the Fock matrix.
+    **kwargs
+        Keyword arguments forwarded to the feature functions.
+
+    Returns
+    -------
+    Callable
+        A jit-compiled function mapping `energy_predictor` over the leading axis of
+        a batched `Molecule`, such as the output of `pad_molecule_batch`.
+        Signature:
+
+        (params: PyTree, molecules: Molecule, *args) -> Tuple[Float[Array, "batch"], Array]
+
+    Notes
+    -----
+    Batches are compiled once per padded shape, so padding every batch to the same
+    number of grid points and orbitals avoids recompilations.
+    """
+
+    predict = energy_predictor(functional, nlc_functional, clip_cte, **kwargs)
+
+    @jit
+    def batched_predict(params: PyTree, molecules: Molecule, *args) -> Tuple[Array, Array]:
+        return vmap(predict, in_axes=(None, 0) + (0,) * len(args))(params, molecules, *args)
+
+    return batched_predict
 
-    return predict
 
 def Harris_energy_predictor(
     functional: Functional,
@@ -323,6 +455,12 @@ def train_kernel(tx: GradientTransformation, loss: Callable) -> Callable:
     Returns
     -------
     Callable
+
+    Notes
+    -----
+    The buffers of `params` and `opt_state` are donated to the kernel, so XLA can update
+    them in place. The arrays passed in must not be used after the call; rebind them to
+    the returned values, as in `params, opt_state, cost, energy = kernel(params, opt_state, ...)`.
     """
 
     def kernel(
@@ -356,7 +494,107 @@ def train_kernel(tx: GradientTransformation, loss: Callable) -> Callable:
 
         return params, opt_state, cost_value, predictedenergy
 
-    return kernel
+    return jit(kernel, donate_argnums=(0, 1))
+
+
+def train_scan(tx: GradientTransformation, loss: Callable) -> Callable:
+    r"""Generate a function that runs consecutive training steps on device.
+
+    The steps of `train_kernel` are chained with `jax.lax.scan` over the leading axis
+    of a batch of molecules, so the parameters and optimizer state stay on device and a
+    whole epoch is compiled and dispatched once.
+
+    Parameters
+    ----------
+    tx : GradientTransformation
+        An optax gradient transformation.
+    loss : Callable
+        A loss function that takes in the parameters, a `Molecule` or `Solid` object, and the ground truth energy
+        and returns a tuple of the loss value and the gradients. See `train_kernel`.
+
+    Returns
+    -------
+    Callable
+        Signature:
+
+        (params: PyTree, opt_state: OptState, atoms: Union[Molecule, Solid], ground_truth_energies: Array)
+        -> Tuple[PyTree, OptState, Array, Array]
+
+        where `atoms` and `ground_truth_energies` have a leading axis with one entry per step,
+        e.g. a `Molecule` batched with `pad_molecule_batch`, so all the steps share the
+        same static `is_restricted` flag. The loss values and predicted energies of every
+        step are returned. As in `train_kernel`, the buffers of `params` and `opt_state`
+        are donated.
+    """
+
+    kernel = train_kernel(tx, loss)
+
+    @partial(jit, donate_argnums=(0, 1))
+    def run(
+        params: PyTree,
+        opt_state: OptState,
+        atoms: Union[Molecule, Solid],
+        ground_truth_energies: Float[Array, "steps"],
+    ) -> Tuple[PyTree, OptState, Float[Array, "steps"], Float[Array, "steps"]]:
+        def step(carry, inputs):
+            params, opt_state = carry
+            params, opt_state, cost_value, predictedenergy = kernel(params, opt_state, *inputs)
+            return (params, opt_state), (cost_value, predictedenergy)
+
+        (params, opt_state), (cost_values, predictedenergies) = scan(
+            step, (params, opt_state), (atoms, ground_truth_energies)
+        )
+        return params, opt_state, cost_values, predictedenergies
+
+    return run
+
+
+def parallel_train_kernel(
+    tx: GradientTransformation, loss: Callable, axis_name: str = "batch"
+) -> Callable:
+    r"""Generate a training kernel that distributes a batch of molecules over devices.
+
+    Each device evaluates the loss on its own molecule(s), and the gradients and loss
+    values are averaged across devices before a single, replicated optimizer update.
+
+    Parameters
+    ----------
+    tx : GradientTransformation
+        An optax gradient transformation.
+    loss : Callable
+        A loss function that takes in the parameters, a `Molecule` or `Solid` object, and the ground truth energy
+        and returns a tuple of the loss value and the gradients. See `train_kernel`.
+    axis_name : str
+        The name of the mapped device axis.
+
+    Returns
+    -------
+    Callable
+        A `jax.pmap`-ed kernel with the same signature as the one returned by `train_kernel`.
+        `atoms` and `ground_truth_energy` must have a leading axis of size `jax.local_device_count()`,
+        such as a `Molecule` batched with `pad_molecule_batch`; params, optimizer state and loss
+        value are returned unreplicated, the predicted energies per device.
+
+    Notes
+    -----
+    As with `batched_energy_predictor`, padding all batches to the same shapes avoids recompilations.
+    """
+
+    def kernel(
+        params: PyTree, opt_state: OptState, atoms: Union[Molecule, Solid], ground_truth_energy: float
+    ) -> Tuple[PyTree, OptState, Scalar, Scalar]:
+        (cost_value, predictedenergy), grads = loss(params, atoms, ground_truth_energy)
+        grads = pmean(grads, axis_name)
+        cost_value = pmean(cost_value, axis_name)
+
+        updates, opt_state = tx.update(grads, opt_state, params)
+        params = apply_updates(params, updates)
+
+        return params, opt_state, cost_value, predictedenergy
+
+    return pmap(
+        kernel, axis_name=axis_name, in_axes=(None, None, 0, 0), out_axes=(None, None, None, 0)
+    )
 
 
 ##################### Regularization #####################
@@ -377,13 +615,21 @@ def fock_grad_regularization(molecule: Molecule, F: Float[Array, "spin ao ao"])
     -------
     Scalar
         The Fock gradient regularization term alternative.
+
+    Notes
+    -----
+    The norm of the target Fock matrix is read from `molecule.fock_norm` when available,
+    and computed otherwise.
     """
-    return jnp.sqrt(jnp.einsum("sij->", (F - molecule.fock) ** 2)) / jnp.sqrt(
-        jnp.einsum("sij->", molecule.fock**2)
-    )
+    fock_norm = molecule.fock_norm
+    if fock_norm is None:
+        fock_norm = jnp.linalg.norm(molecule.fock)
+    return jnp.linalg.norm(F - molecule.fock) / fock_norm
 
 
-def dm21_grad_regularization(molecule: Molecule, F: Float[Array, "spin ao ao"]) -> Scalar:
+def dm21_grad_regularization(
+    molecule: Molecule, F: Float[Array, "spin ao ao"], compute_dtype: Optional[DType] = None
+) -> Scalar:
     """Calculates the default gradient regularization term for a `Molecule` given a Fock matrix.
 
     Parameters
@@ -392,6 +638,10 @@ def dm21_grad_regularization(molecule: Molecule, F: Float[Array, "spin ao ao"])
         A `Molecule` object.
     F : Array
         The Fock matrix array. Has to be of the same shape as `molecule.density_matrix`
+    compute_dtype : DType, optional
+        If given, the Fock matrix and orbital coefficients are cast to this (lower precision)
+        dtype for the contractions, which still accumulate in the dtype of `F`.
+        By default, no cast is performed.
 
     Returns
     -------
@@ -403,26 +653,33 @@ def dm21_grad_regularization(molecule: Molecule, F: Float[Array, "spin ao ao"])
     e = molecule.mo_energy
     C = molecule.mo_coeff
 
+    dtype = F.dtype
+    if compute_dtype is not None:
+        F, C = F.astype(compute_dtype), C.astype(compute_dtype)
+
     # factors = jnp.einsum("sba,sac,scd->sbd", C.transpose(0,2,1), F, C) ** 2
     # factors = jnp.einsum("sab,sac,scd->sbd", C, F, C) ** 2
     # factors = jnp.einsum("sac,sab,scd->sbd", F, C, C) ** 2
-    factors = jnp.einsum("sac,sab,scd->sbd", F, C, C) ** 2  # F is symmetric
-
-    numerator = n[:, :, None] - n[:, None, :]
-    denominator = e[:, :, None] - e[:, None, :]
+    # Contracted pairwise so that both steps are batched matrix products
+    FC = jnp.einsum("sac,scd->sad", F, C)
+    factors = jnp.einsum("sab,sad->sbd", C, FC, preferred_element_type=dtype)
 
-    mask = jnp.logical_and(jnp.abs(factors) > 0, jnp.abs(numerator) > 0)
+    # F is symmetric, so the summand is symmetric in the orbital pair and vanishes on the
+    # diagonal: half the sum over all pairs is the sum over the strict upper triangle
+    b, d = jnp.triu_indices(factors.shape[-1], k=1)
+    factors = jnp.square(factors[:, b, d])
+    numerator = n[:, b] - n[:, d]
+    denominator = e[:, b] - e[:, d]
 
-    safe_denominator = jnp.where(mask, denominator, 1.0)
+    # Pairs of orbitals with equal occupations or energies do not contribute. Over all the pairs,
+    # the (b, d) and (d, b) terms of degenerate orbitals cancel each other, so they are set to
+    # zero rather than to the largest finite value, which would saturate the term below
+    prefactors = jnp.nan_to_num(numerator / denominator, nan=0.0, posinf=0.0, neginf=0.0)
 
-    second_mask = jnp.abs(safe_denominator) > 0
-    safe_denominator = jnp.where(second_mask, safe_denominator, 1.0e-20)
+    # Smoothly saturates at +-10, so that large deviations still get a gradient
+    dE = 10 * jnp.tanh(0.1 * jnp.sum(prefactors * factors))
 
-    prefactors = numerator / safe_denominator
-
-    dE = jnp.clip(0.5 * jnp.sum(prefactors * factors), a_min=-10, a_max=10)
-
-    return dE**2
+    return jnp.square(dE)
 
 
 def orbital_grad_regularization(molecule: Molecule, F: Float[Array, "spin ao ao"]) -> Scalar:
@@ -431,15 +688,15 @@ def orbital_grad_regularization(molecule: Molecule, F: Float[Array, "spin ao ao"
     #  Calculate the gradient regularization term
     new_grad = get_grad(molecule.mo_coeff, molecule.mo_occ, F)
 
-    dE = jnp.linalg.norm(new_grad - molecule.training_gorb_grad, ord="fro")
-
-    return dE**2
+    # Squared Frobenius norm, without the intermediate square root
+    return jnp.sum(jnp.square(new_grad - molecule.training_gorb_grad))
 
 
 def get_grad(
     mo_coeff: Float[Array, "spin ao ao"],
     mo_occ: Float[Array, "spin ao"],
     F: Float[Array, "spin ao ao"],
+    compute_dtype: Optional[DType] = None,
 ):
     """RHF orbital gradients
 
@@ -451,6 +708,9 @@ def get_grad(
         Orbital occupancy
     F: 2D ndarray
         Fock matrix in AO representation
+    compute_dtype: DType, optional
+        If given, the contractions are computed in this dtype and accumulated in the
+        dtype of `F`. By default, no cast is performed.
 
     Returns:
     --------
@@ -466,10 +726,15 @@ def get_grad(
     return g.ravel()
     """
 
-    C_occ = vmap(jnp.where, in_axes=(None, 1, None), out_axes=1)(mo_occ > 0, mo_coeff, 0)
-    C_vir = vmap(jnp.where, in_axes=(None, 1, None), out_axes=1)(mo_occ == 0, mo_coeff, 0)
+    C_occ = jnp.where((mo_occ > 0)[:, None, :], mo_coeff, 0)
+    C_vir = jnp.where((mo_occ == 0)[:, None, :], mo_coeff, 0)
+
+    dtype = F.dtype
+    if compute_dtype is not None:
+        F, C_occ, C_vir = F.astype(compute_dtype), C_occ.astype(compute_dtype), C_vir.astype(compute_dtype)
 
-    return jnp.einsum("sab,sac,scd->bd", C_vir.conj(), F, C_occ)
+    FC_occ = jnp.einsum("sac,scd->sad", F, C_occ)
+    return jnp.einsum("sab,sad->bd", C_vir.conj(), FC_occ, preferred_element_type=dtype)
 
 
 ##################### Loss Functions #####################
@@ -26,6 +26,6 @@ from .types import (
     default_dtype,
 )
 from .tree import tree_size, tree_isfinite, tree_randn_like, tree_func, tree_shape
-from .utils import to_device_arrays, Utils
+from .utils import to_device_arrays, einsum_path, Utils
 from .chunk import vmap_chunked
 from .eigenproblem import safe_fock_solver
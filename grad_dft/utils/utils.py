@@ -13,10 +13,12 @@
 # limitations under the License.
 
 import argparse
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional, Tuple
 from grad_dft.utils import DType, default_dtype
 import jax.numpy as jnp
 import json
+import opt_einsum
 
 
 def to_device_arrays(*arrays, dtype: Optional[DType] = None):
@@ -26,6 +28,16 @@ def to_device_arrays(*arrays, dtype: Optional[DType] = None):
     return [jnp.asarray(array, dtype=dtype) for array in arrays]
 
 
+@lru_cache(maxsize=128)
+def einsum_path(subscripts: str, *shapes: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+    r"""Returns the optimal contraction path of an einsum for the given operand shapes.
+
+    The path is cached on the subscripts and shapes, so it is only searched for once
+    per combination and can be passed as the `optimize` argument of `jnp.einsum`.
+    """
+    return opt_einsum.contract_path(subscripts, *shapes, shapes=True, optimize="optimal")[0]
+
+
 class Utils:
     def __init__(self, config_path: str = ""):
         if config_path != "":
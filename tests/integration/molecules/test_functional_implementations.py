@@ -53,11 +53,17 @@ mols = [
     gto.M(atom="Li 0 0 0", spin = 1, basis = "def2-tzvp"),
 ]
 
-#### LSDA ####
-@pytest.mark.parametrize("mol", mols)
-def test_lda(mol):
-    mf = dft.UKS(mol)
+# The classical functional tests share one UKS object per molecule and only change mf.xc,
+# so the grid, the integrals and the ERIs held in mf._eri are computed once per molecule.
+# A module scoped fixture also makes pytest run all the tests of one molecule before the next.
+@pytest.fixture(scope="module", params=mols)
+def mf(request):
+    mf = dft.UKS(request.param)
     mf.grids = grids
+    return mf
+
+#### LSDA ####
+def test_lda(mf):
     mf.xc = "LDA" # LDA is the same as LDA_X.
     ground_truth_energy = mf.kernel()
 
@@ -71,10 +77,7 @@ def test_lda(mol):
     assert jnp.allclose(lsdadiff, 0, atol=1e-3)
 
 ##### B88 ####
-@pytest.mark.parametrize("mol", mols)
-def test_b88(mol):
-    mf = dft.UKS(mol)
-    mf.grids = grids
+def test_b88(mf):
     mf.xc = "B88"
     ground_truth_energy = mf.kernel()
 
@@ -88,10 +91,7 @@ def test_b88(mol):
     assert jnp.allclose(b88diff, 0, atol=1e-3)
 
 ##### VWN ####
-@pytest.mark.parametrize("mol", mols)
-def test_vwn(mol):
-    mf = dft.UKS(mol)
-    mf.grids = grids
+def test_vwn(mf):
     mf.xc = "LDA_C_VWN"
     ground_truth_energy = mf.kernel()
 
@@ -108,10 +108,7 @@ def test_vwn(mol):
 # This test differs slightly due to the use of the original LYP functional definition
 # in C. Lee, W. Yang, and R. G. Parr., Phys. Rev. B 37, 785 (1988) (doi: 10.1103/PhysRevB.37.785)
 # instead of the one in libxc: B. Miehlich, A. Savin, H. Stoll, and H. Preuss., Chem. Phys. Lett. 157, 200 (1989) (doi: 10.1016/0009-2614(89)87234-3)
-@pytest.mark.parametrize("mol", mols)
-def test_lyp(mol):
-    mf = dft.UKS(mol)
-    mf.grids = grids
+def test_lyp(mf):
     mf.xc = "GGA_C_LYP"
     ground_truth_energy = mf.kernel()
 
@@ -130,10 +127,7 @@ def test_lyp(mol):
 # This test differs slightly due to the use of the original LYP functional definition
 # in C. Lee, W. Yang, and R. G. Parr., Phys. Rev. B 37, 785 (1988) (doi: 10.1103/PhysRevB.37.785)
 # instead of the one in libxc: B. Miehlich, A. Savin, H. Stoll, and H. Preuss., Chem. Phys. Lett. 157, 200 (1989) (doi: 10.1016/0009-2614(89)87234-3)
-@pytest.mark.parametrize("mol", mols)
-def test_b3lyp(mol):
-    mf = dft.UKS(mol)
-    mf.grids = grids
+def test_b3lyp(mf):
     mf.xc = "b3lyp"
     ground_truth_energy = mf.kernel()
 
@@ -148,10 +142,7 @@ def test_b3lyp(mol):
 
 
 #### PW92 ####
-@pytest.mark.parametrize("mol", mols)
-def test_pw92(mol):
-    mf = dft.UKS(mol)
-    mf.grids = grids
+def test_pw92(mf):
     mf.xc = "LDA_C_PW"
     ground_truth_energy = mf.kernel()
 
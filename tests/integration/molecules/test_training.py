@@ -23,6 +23,15 @@ the training set. This means that, for SCF and non-SCF training, we should have:
 
 """
 
+import os
+
+# Two host devices for test_parallel_train_kernel. Only effective before jax is initialized,
+# so when this module runs on its own
+if "xla_force_host_platform_device_count" not in os.environ.get("XLA_FLAGS", ""):
+    os.environ["XLA_FLAGS"] = (
+        os.environ.get("XLA_FLAGS", "") + " --xla_force_host_platform_device_count=2"
+    ).strip()
+
 from jax.random import PRNGKey
 import jax.numpy as jnp
 from jax import grad
@@ -41,13 +50,20 @@ from grad_dft import (
     simple_scf_loop, 
     non_scf_predictor,
     Molecule,
-    NeuralFunctional
+    NeuralFunctional,
+    energy_predictor,
+    batched_energy_predictor,
+    pad_molecule_batch,
+    train_kernel,
+    train_scan,
+    parallel_train_kernel,
 )
 
 from jax.nn import sigmoid, gelu
 from flax import linen as nn
 from optax import adam, apply_updates
-from jax import config, value_and_grad
+from jax import config, value_and_grad, tree_util, local_device_count
+from functools import partial
 config.update("jax_enable_x64", True)
 
 # Two H2 geometries. Small basis set
@@ -225,4 +241,87 @@ def test_minimize(train_recipe: tuple) -> None:
         loss_args[0] = tr_params
     assert (
         cost_history[-1] <= cost_history[0]
-    ), f"Training recipe for loss function {loss_func.__name__} and {predictor_name} did not reduce the cost in 5 iterations"
\ No newline at end of file
+    ), f"Training recipe for loss function {loss_func.__name__} and {predictor_name} did not reduce the cost in 5 iterations"
+
+
+def test_batched_energy_predictor() -> None:
+    r"""Check that predicting on a padded batch of molecules reproduces the
+    energies and Fock matrices predicted for each molecule separately.
+    """
+    predict = energy_predictor(NF)
+    batched_predict = batched_energy_predictor(NF)
+    energies, focks = batched_predict(PARAMS, pad_molecule_batch(MOLECULES))
+    for i, molecule in enumerate(MOLECULES):
+        energy, fock = predict(PARAMS, molecule)
+        n_orb = fock.shape[-1]
+        assert jnp.isclose(energies[i], energy), f"Batched energy of molecule {i} differs from the unbatched one"
+        assert jnp.allclose(focks[i, :, :n_orb, :n_orb], fock), f"Batched Fock matrix of molecule {i} differs from the unbatched one"
+        assert not focks[i, :, n_orb:, n_orb:].any(), f"Padded Fock matrix entries of molecule {i} should be zero"
+
+
+# The CISD energies of the two molecules
+KERNEL_TRUTH_ENERGIES = jnp.array(TRUTH_ENERGIES[1::2])
+PREDICT = energy_predictor(NF)
+
+
+@partial(value_and_grad, has_aux=True)
+def kernel_loss(params, molecule, true_energy):
+    predicted_energy, _ = PREDICT(params, molecule)
+    return (predicted_energy - true_energy) ** 2, predicted_energy
+
+
+def test_train_scan() -> None:
+    r"""Check that scanning over a padded batch of molecules reproduces the parameters,
+    losses and energies of one `train_kernel` step per molecule.
+    """
+    tx = adam(learning_rate=LR, b1=MOMENTUM)
+    kernel = train_kernel(tx, kernel_loss)
+    # The kernels donate the parameters and optimizer states, so each gets its own
+    params = NF.init(KEY, CINPUTS)
+    opt_state = tx.init(params)
+    costs, energies = [], []
+    for molecule, energy in zip(MOLECULES, KERNEL_TRUTH_ENERGIES):
+        params, opt_state, cost, predicted_energy = kernel(params, opt_state, molecule, energy)
+        costs.append(cost)
+        energies.append(predicted_energy)
+
+    scan_params = NF.init(KEY, CINPUTS)
+    scan_params, _, scan_costs, scan_energies = train_scan(tx, kernel_loss)(
+        scan_params, tx.init(scan_params), pad_molecule_batch(MOLECULES), KERNEL_TRUTH_ENERGIES
+    )
+
+    assert jnp.allclose(scan_costs, jnp.array(costs)), "Scanned losses differ from the kernel ones"
+    assert jnp.allclose(scan_energies, jnp.array(energies)), "Scanned energies differ from the kernel ones"
+    assert tree_util.tree_all(
+        tree_util.tree_map(jnp.allclose, scan_params, params)
+    ), "Scanned parameters differ from the kernel ones"
+
+
+@pytest.mark.skipif(local_device_count() < 2, reason="Needs at least two devices")
+def test_parallel_train_kernel() -> None:
+    r"""Check that distributing the two molecules over two devices reproduces a
+    `train_kernel` step on the loss averaged over both molecules.
+    """
+    tx = adam(learning_rate=LR, b1=MOMENTUM)
+
+    def mean_loss(params, molecules, true_energies):
+        values, grads = zip(*[kernel_loss(params, *inputs) for inputs in zip(molecules, true_energies)])
+        costs, energies = zip(*values)
+        mean = lambda *xs: sum(xs) / len(xs)
+        return (mean(*costs), jnp.stack(energies)), tree_util.tree_map(mean, *grads)
+
+    params = NF.init(KEY, CINPUTS)
+    params, _, cost, energies = train_kernel(tx, mean_loss)(
+        params, tx.init(params), MOLECULES, KERNEL_TRUTH_ENERGIES
+    )
+
+    parallel_params = NF.init(KEY, CINPUTS)
+    parallel_params, _, parallel_cost, parallel_energies = parallel_train_kernel(tx, kernel_loss)(
+        parallel_params, tx.init(parallel_params), pad_molecule_batch(MOLECULES), KERNEL_TRUTH_ENERGIES
+    )
+
+    assert jnp.allclose(parallel_cost, cost), "Device-averaged loss differs from the single device one"
+    assert jnp.allclose(parallel_energies, energies), "Per-device energies differ from the single device ones"
+    assert tree_util.tree_all(
+        tree_util.tree_map(jnp.allclose, parallel_params, params)
+    ), "Device-parallel parameters differ from the single device ones"
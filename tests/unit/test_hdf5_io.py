@@ -0,0 +1,105 @@
+# Copyright 2023 Xanadu Quantum Technologies Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The goal of this module is to test that the molecules saved with `saver` in ~/interface/pyscf.py
+are loaded back by `loader` with:
+
+(1) The same values, shapes and dtypes, including the ERIs, which are stored packed
+with their 8-fold permutational symmetry.
+
+(2) The optional fields left to None still set to None.
+
+(3) The orbitals stored in single precision loaded back in double precision, for molecules
+on their own and in reactions.
+"""
+
+import os
+
+from jax import config
+import jax.numpy as jnp
+import h5py
+import pytest
+
+from pyscf import gto, dft
+
+from grad_dft import molecule_from_pyscf, make_reaction, saver, loader
+
+config.update("jax_enable_x64", True)
+
+mf = dft.UKS(gto.M(atom="O 0 0 0; H 0 0 0.97", basis="6-31g", spin=1))
+mf.grids.level = 1
+mf.kernel()
+
+MOLECULES = [
+    molecule_from_pyscf(mf, omegas=[0.0, 0.4], energy=-75.0, name="OH"),
+    molecule_from_pyscf(mf),
+]
+
+
+def assert_same_molecule(loaded, molecule, rtol=1e-12, atol=0.0):
+    loaded, molecule = loaded.to_dict(), molecule.to_dict()
+    assert loaded.keys() == molecule.keys()
+    for key, value in molecule.items():
+        if value is None:
+            assert loaded[key] is None, key
+            continue
+        if isinstance(value, dict):  # grad_n_ao
+            assert loaded[key].keys() == value.keys(), key
+            pairs = [(loaded[key][order], value[order]) for order in value]
+        else:
+            pairs = [(loaded[key], value)]
+        for loaded_value, value in pairs:
+            assert jnp.shape(loaded_value) == jnp.shape(value), key
+            assert jnp.allclose(loaded_value, jnp.asarray(value), rtol=rtol, atol=atol), key
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_molecule_roundtrip(molecule, tmp_path):
+    fname = os.path.join(tmp_path, "molecule.hdf5")
+    saver(fname, molecules=molecule)
+
+    with h5py.File(fname, "r") as file:
+        (group,) = file.values()
+        assert group["rep_tensor"].ndim == 1
+        for key, value in molecule.to_dict().items():
+            assert (key in group) == (value is not None), key
+
+    ((kind, loaded),) = list(loader(fname, randomize=False))
+    assert kind == "molecule"
+    assert loaded.ao.dtype == jnp.float64 and loaded.rep_tensor.dtype == jnp.float64
+    assert_same_molecule(loaded, molecule)
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_single_precision_orbitals(molecule, tmp_path):
+    fname = os.path.join(tmp_path, "molecule.hdf5")
+    reaction = make_reaction([molecule], [molecule], energy=0.0)
+    saver(fname, reactions=reaction, molecules=molecule, single_precision_orbitals=True)
+
+    with h5py.File(fname, "r") as file:
+        groups = []  # The molecule, reactant and product groups
+        file.visititems(
+            lambda _, obj: groups.append(obj) if isinstance(obj, h5py.Group) and "ao" in obj else None
+        )
+        assert len(groups) == 3
+        for group in groups:
+            assert group["ao"].dtype == "float32"
+            assert group["grad_n_ao"]["2"].dtype == "float32"
+            assert group["rep_tensor"].dtype == "float64"
+
+    loaded = dict(loader(fname, randomize=False))
+    for loaded_molecule in [loaded["molecule"], *loaded["reaction"].reactants, *loaded["reaction"].products]:
+        for orbitals in [loaded_molecule.ao, loaded_molecule.grad_ao, *loaded_molecule.grad_n_ao.values()]:
+            assert orbitals.dtype == jnp.float64
+        assert_same_molecule(loaded_molecule.replace(name=molecule.name), molecule, rtol=1e-5, atol=1e-6)
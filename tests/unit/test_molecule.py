@@ -0,0 +1,99 @@
+# Copyright 2023 Xanadu Quantum Technologies Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The goal of this module is to test that restricted molecules, whose spin-resolved features
+are computed from a single spin channel, produce:
+
+(1) The same features, energies, Fock matrices and derivatives with respect to the atomic
+orbitals as the unrestricted path, also for functionals that are not spin symmetric.
+
+(2) The restricted flag only for closed-shell systems.
+
+(3) The chi tensor of the requested omegas, or an error (NaN when traced) for missing ones.
+"""
+
+from jax import config, grad, jit
+import jax.numpy as jnp
+import pytest
+
+from pyscf import gto, dft
+
+from grad_dft import molecule_from_pyscf, pad_molecule_batch
+
+config.update("jax_enable_x64", True)
+
+mf = dft.RKS(gto.M(atom="H 0 0 0; H 0 0 0.74", basis="cc-pvdz"))
+mf.grids.level = 1
+mf.kernel()
+RESTRICTED = molecule_from_pyscf(mf, omegas=[0.0, 0.4])
+UNRESTRICTED = RESTRICTED.replace(is_restricted=False)
+
+
+
+def spin_asymmetric_energy(rdm1, molecule, ao=None):
+    r"""A toy energy that weights the features of each spin channel differently."""
+    molecule = molecule.replace(rdm1=rdm1)
+    if ao is not None:
+        molecule = molecule.replace(ao=ao)
+    rho = molecule.density()
+    grad_rho = molecule.grad_density()
+    tau = molecule.kinetic_density()
+    lapl_rho = molecule.lapl_density()
+    energy_density = (
+        rho[:, 0] ** (4 / 3)
+        + 0.3 * rho[:, 1] ** (4 / 3)
+        + 0.1 * jnp.sum(grad_rho[:, 0] ** 2, axis=-1)
+        + 0.05 * tau[:, 1]
+        + 0.01 * lapl_rho[:, 0]
+    )
+    return molecule.grid.integrate(energy_density)
+
+
+def test_restricted_flag():
+    assert RESTRICTED.is_restricted
+
+    mf = dft.ROKS(gto.M(atom="O 0 0 0; H 0 0 0.97", basis="sto-3g", spin=1))
+    mf.kernel()
+    assert not molecule_from_pyscf(mf).is_restricted
+
+
+def test_restricted_features():
+    rdm1 = RESTRICTED.rdm1
+    energy = spin_asymmetric_energy(rdm1, RESTRICTED)
+    fock = grad(spin_asymmetric_energy)(rdm1, RESTRICTED)
+
+    assert jnp.allclose(energy, spin_asymmetric_energy(rdm1, UNRESTRICTED))
+    assert jnp.allclose(fock, grad(spin_asymmetric_energy)(rdm1, UNRESTRICTED))
+    # The functional is not spin symmetric, so the Fock matrices of the two channels differ
+    assert not jnp.allclose(fock[0], fock[1])
+
+    grad_ao = grad(spin_asymmetric_energy, argnums=2)(rdm1, RESTRICTED, RESTRICTED.ao)
+    assert jnp.allclose(grad_ao, grad(spin_asymmetric_energy, argnums=2)(rdm1, UNRESTRICTED, RESTRICTED.ao))
+
+
+def test_pad_mixed_restriction():
+    with pytest.raises(ValueError):
+        pad_molecule_batch([RESTRICTED, UNRESTRICTED])
+
+
+def test_select_HF_omegas():
+    chi = RESTRICTED.select_HF_omegas([0.4, 0.0])
+    assert jnp.allclose(chi, RESTRICTED.chi[:, ::-1])
+    assert jnp.allclose(jit(RESTRICTED.select_HF_omegas)(jnp.array([0.4, 0.0])), chi)
+
+    with pytest.raises(ValueError):
+        RESTRICTED.select_HF_omegas([0.3])
+    chi = jit(lambda molecule: molecule.select_HF_omegas([0.4, 0.3]))(RESTRICTED)
+    assert jnp.allclose(chi[:, 0], RESTRICTED.chi[:, 1])
+    assert jnp.isnan(chi[:, 1]).all()
@@ -0,0 +1,127 @@
+# Copyright 2023 Xanadu Quantum Technologies Inc.
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The goal of this module is to test that the regularization terms in ~/grad_dft/train.py produce:
+
+(1) The same values and gradients as the reference implementations with masked divisions and
+sums over all the orbital pairs, also when two orbitals with different occupations are degenerate.
+
+(2) A DM21 regularization that matches the original one clipped at +-10 for small deviations
+and saturates at the same value for large ones.
+
+Only the symmetric part of the gradients with respect to the Fock matrix is compared, since
+the Fock matrix is symmetric and the upper triangle of the orbital pairs is summed.
+"""
+
+from jax import config, grad, vmap
+from jax.random import PRNGKey, normal
+import jax.numpy as jnp
+import pytest
+
+from pyscf import gto, dft
+
+from grad_dft import molecule_from_pyscf
+from grad_dft.train import dm21_grad_regularization, get_grad
+
+config.update("jax_enable_x64", True)
+
+mf = dft.UKS(gto.M(atom="O 0 0 0; H 0 0.76 0.58; H 0 -0.76 0.58", basis="sto-3g"))
+mf.grids.level = 1
+mf.kernel()
+MOLECULE = molecule_from_pyscf(mf)
+
+noise = normal(PRNGKey(1984), MOLECULE.fock.shape)
+FOCK = MOLECULE.fock + 0.01 * (noise + noise.transpose(0, 2, 1))
+LARGE_FOCK = MOLECULE.fock + 10 * (noise + noise.transpose(0, 2, 1))
+
+# Make the HOMO and LUMO of the first spin channel degenerate
+homo = int(MOLECULE.mo_occ[0].sum()) - 1
+DEGENERATE = MOLECULE.replace(
+    mo_energy=MOLECULE.mo_energy.at[0, homo + 1].set(MOLECULE.mo_energy[0, homo])
+)
+
+MOLECULES = [MOLECULE, DEGENERATE]
+
+
+def reference_dm21_deviation(molecule, F):
+    r"""The deviation in the DM21 regularization, with the original masked division."""
+    n = molecule.mo_occ
+    e = molecule.mo_energy
+    C = molecule.mo_coeff
+
+    factors = jnp.einsum("sac,sab,scd->sbd", F, C, C) ** 2
+    # F is symmetric. The factors are symmetrized to the last bit, so that the (b, d) and (d, b)
+    # terms of degenerate orbitals cancel exactly instead of leaving rounding errors times 1e20
+    factors = (factors + factors.transpose(0, 2, 1)) / 2
+
+    numerator = n[:, :, None] - n[:, None, :]
+    denominator = e[:, :, None] - e[:, None, :]
+
+    mask = jnp.logical_and(jnp.abs(factors) > 0, jnp.abs(numerator) > 0)
+    safe_denominator = jnp.where(mask, denominator, 1.0)
+    second_mask = jnp.abs(safe_denominator) > 0
+    safe_denominator = jnp.where(second_mask, safe_denominator, 1.0e-20)
+
+    prefactors = numerator / safe_denominator
+    # The terms are added in (b, d) and (d, b) pairs before the sum, for the same reason
+    terms = prefactors * factors
+    return 0.25 * jnp.sum(terms + terms.transpose(0, 2, 1))
+
+
+def reference_dm21_regularization(molecule, F):
+    return (10 * jnp.tanh(0.1 * reference_dm21_deviation(molecule, F))) ** 2
+
+
+def clipped_dm21_regularization(molecule, F):
+    return jnp.clip(reference_dm21_deviation(molecule, F), a_min=-10, a_max=10) ** 2
+
+
+def symmetrize(gradient):
+    return (gradient + gradient.transpose(0, 2, 1)) / 2
+
+
+def reference_get_grad(mo_coeff, mo_occ, F):
+    C_occ = vmap(jnp.where, in_axes=(None, 1, None), out_axes=1)(mo_occ > 0, mo_coeff, 0)
+    C_vir = vmap(jnp.where, in_axes=(None, 1, None), out_axes=1)(mo_occ == 0, mo_coeff, 0)
+    return jnp.einsum("sab,sac,scd->bd", C_vir.conj(), F, C_occ)
+
+
+@pytest.mark.parametrize("molecule", MOLECULES)
+def test_dm21_grad_regularization(molecule):
+    regularization = dm21_grad_regularization(molecule, FOCK)
+    assert jnp.isclose(regularization, reference_dm21_regularization(molecule, FOCK))
+
+    gradient = grad(dm21_grad_regularization, argnums=1)(molecule, FOCK)
+    assert not jnp.isnan(gradient).any()
+    reference_gradient = grad(reference_dm21_regularization, argnums=1)(molecule, FOCK)
+    assert jnp.allclose(symmetrize(gradient), symmetrize(reference_gradient))
+
+
+def test_dm21_grad_regularization_saturation():
+    # Small deviations: the smooth saturation agrees with the original clipping
+    regularization = dm21_grad_regularization(MOLECULE, FOCK)
+    assert 0 < regularization < 1
+    assert jnp.isclose(regularization, clipped_dm21_regularization(MOLECULE, FOCK), rtol=1e-2)
+
+    # Large deviations: both saturate at 10**2, but the gradient does not vanish
+    assert jnp.isclose(clipped_dm21_regularization(MOLECULE, LARGE_FOCK), 100)
+    assert jnp.isclose(dm21_grad_regularization(MOLECULE, LARGE_FOCK), 100)
+    assert grad(dm21_grad_regularization, argnums=1)(MOLECULE, 0.1 * LARGE_FOCK).any()
+
+
+def test_get_grad():
+    assert jnp.allclose(
+        get_grad(MOLECULE.mo_coeff, MOLECULE.mo_occ, FOCK),
+        reference_get_grad(MOLECULE.mo_coeff, MOLECULE.mo_occ, FOCK),
+    )